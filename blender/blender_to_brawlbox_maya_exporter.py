@@ -27,11 +27,14 @@ possible support for exporting .dae's:
 #.anim format
 #https://knowledge.autodesk.com/support/maya/learn-explore/caas/CloudHelp/cloudhelp/2016/ENU/Maya/files/GUID-87541258-2463-497A-A3D7-3DEA4C852644-htm.html 
 
+import itertools
 import math
 import os
 import re
 import xml.etree.ElementTree as ET
-from math import atan2, ceil, cos, degrees, floor, isclose, pi, radians, sin,tan
+from math import atan2, ceil, cos, degrees, floor, isclose, pi, radians, sin
+
+import numpy as np
 
 import bpy
 from bpy.props import BoolProperty, EnumProperty, IntProperty, StringProperty,CollectionProperty
@@ -105,31 +108,159 @@ def register_wrap(cls):
 
 def get_filename(path):
     return os.path.splitext(os.path.basename(path))[0]
-def trim_comments(anim_file_lines):
-    result = []
-    for line in anim_file_lines:
+def clean_anim_lines(anim_file):
+    #removes comments, semicolons and leading and trailing whitespace, one line at a time
+    for line in anim_file:
         if not line.startswith(r'//'):
-            result.append(line)
-    return result
-def read_until(start_index, lines, break_symbol):
-    result = []
-    for i, line in enumerate_start(start_index, lines):
-
-        if break_symbol in line:
-            break
-        else:
-            result.append(line)
-
-    return i, result
-def line_value_int(line):
-    #assumes line in format of 'identifier value'
-    return int(line.split(' ')[1])
-def line_value_str(line):
-    #assumes line in format of 'identifier value'
-    return line.split(' ')[1]
-
-def action_from_maya_anim_format(context, anim_name, anim_file_lines,from_maya, use_brawl_bind):
-
+            yield line.replace(';', '').strip()
+def iter_maya_anim_records(anim_file):
+    '''
+    streams a maya .anim file (any iterable of lines, like an open file), yielding records as they're read:
+        ('header', identifier, value) for each header line before the first anim line
+        ('anim', anim_line, key_lines) for each anim line, key_lines being the lines of its keys block (None without animData)
+    only one channel's key lines are held at a time, so memory doesn't grow with the file size
+    '''
+    lines = clean_anim_lines(anim_file)
+    in_header = True
+    line = next(lines, None)
+    while line is not None:
+        if line.startswith('anim '):
+            in_header = False
+            anim_line = line
+            key_lines = None
+            line = next(lines, None)
+            if line is not None and line.startswith('animData'):
+                '''if exists, animData must follow the anim line  according to format specs'''
+                #skip the animData attribute lines
+                '''assumes keys open-bracket occurs on same line'''
+                for line in lines:
+                    if 'keys' in line:
+                        break
+                key_lines = []
+                for line in lines:
+                    if '}' in line:
+                        break
+                    key_lines.append(line)
+                #the line after the keys block is animData's closing bracket, which is skipped below
+                line = next(lines, None)
+            yield ('anim', anim_line, key_lines)
+            continue
+
+        if in_header and line:
+            #assumes line in format of 'identifier value'
+            line_split = line.split(' ')
+            yield ('header', line_split[0], line_split[1] if len(line_split) > 1 else '')
+        line = next(lines, None)
+
+def decode_anim_keys(key_lines, value_offset=0, value_scaling=1, angle_scaling=1):
+    '''
+    decodes the lines of a keys block in bulk. Returns numpy arrays:
+        frames, values, types_left, types_right, angles_left, weights_left, angles_right, weights_right
+    values are (value - value_offset) * value_scaling and angles are scaled by angle_scaling.
+    angles and weights are 0 for tangents that aren't 'fixed'.
+    '''
+    #key line: frame value type_left type_right tan_locked weight_locked breakdown [angle weight] [angle weight]
+    #padded to the longest line format so the whole block becomes one string table
+    fields = np.array([(key_line.split(' ') + ['0'] * 4)[:11] for key_line in key_lines], dtype=str).reshape(-1, 11)
+
+    frames = fields[:, 0].astype(np.float64)
+    values = (fields[:, 1].astype(np.float64) - value_offset) * value_scaling
+    types_left = fields[:, 2]
+    types_right = fields[:, 3]
+
+    fixed_left = types_left == 'fixed'
+    fixed_right = types_right == 'fixed'
+    tangents = fields[:, 7:11].astype(np.float64)
+    #the right tangent follows the left one if both are given, otherwise it takes the first slot
+    tangents_right = np.where(fixed_left[:, None], tangents[:, 2:4], tangents[:, 0:2])
+
+    angles_left = np.where(fixed_left, tangents[:, 0], 0.0) * angle_scaling
+    weights_left = np.where(fixed_left, tangents[:, 1], 0.0)
+    angles_right = np.where(fixed_right, tangents_right[:, 0], 0.0) * angle_scaling
+    weights_right = np.where(fixed_right, tangents_right[:, 1], 0.0)
+
+    return frames, values, types_left, types_right, angles_left, weights_left, angles_right, weights_right
+
+#raw values of the keyframe enums, as foreach_get/foreach_set read and write them
+keyframe_handle_free = 0
+keyframe_handle_auto = 1
+keyframe_interpolation_bezier = 2
+def write_anim_channel(fcurve, frames, values, types_left, types_right, angles_left, weights_left, angles_right, weights_right, is_rotation, from_maya):
+    '''
+    writes decoded keys (see decode_anim_keys) to the fcurve in bulk. Existing keys on the same frames are replaced,
+    like keyframe_points.insert would, and the remaining ones are kept.
+    '''
+    #I think the tangent is given in units of degrees, so we have to convert to rads for blender?
+    tangent_scaling = math.pi/180.0 if is_rotation else 1
+
+    #for rotation componemnts, blender treats writes as if they're in radians, the unit of the rotation component., yet (i think) the ratio is already in degrees/frames
+    offsets_left = np.stack((np.full_like(angles_left, -1.0), -np.tan(angles_left)), axis=1)
+    offsets_right = np.stack((np.ones_like(angles_right), np.tan(angles_right)), axis=1)
+    if from_maya:
+        #https://download.autodesk.com/us/maya/2010help/API/class_m_fn_anim_curve.html
+        '''
+         One important note is how the outgoing and incoming tangents directions for a key are saved internally and in the Maya Ascii file format.
+         Instead of being specified as points, the tangent directions are specified as vectors. The outgoing tangent direction at P1 is specified and
+         saved as the vector 3*(P2 - P1) and the incoming tangent direction is specified and saved as the vector 3*(P4 - P3).
+        '''
+        offsets_left *= (weights_left / np.linalg.norm(offsets_left, axis=1))[:, None]
+        offsets_right *= (weights_right / np.linalg.norm(offsets_right, axis=1))[:, None]
+    offsets_left[:, 1] *= tangent_scaling
+    offsets_right[:, 1] *= tangent_scaling
+
+    new_co = np.stack((frames, values), axis=1)
+    new_handle_types_left = np.where(types_left == 'fixed', keyframe_handle_free, keyframe_handle_auto)
+    new_handle_types_right = np.where(types_right == 'fixed', keyframe_handle_free, keyframe_handle_auto)
+
+    keyframe_points = fcurve.keyframe_points
+    old_count = len(keyframe_points)
+    old_co = np.empty(old_count * 2, np.float32)
+    old_handles_left = np.empty(old_count * 2, np.float32)
+    old_handles_right = np.empty(old_count * 2, np.float32)
+    old_handle_types_left = np.empty(old_count, np.int32)
+    old_handle_types_right = np.empty(old_count, np.int32)
+    old_interpolations = np.empty(old_count, np.int32)
+    keyframe_points.foreach_get('co', old_co)
+    keyframe_points.foreach_get('handle_left', old_handles_left)
+    keyframe_points.foreach_get('handle_right', old_handles_right)
+    keyframe_points.foreach_get('handle_left_type', old_handle_types_left)
+    keyframe_points.foreach_get('handle_right_type', old_handle_types_right)
+    keyframe_points.foreach_get('interpolation', old_interpolations)
+    old_co = old_co.reshape(-1, 2)
+    kept = ~np.isin(old_co[:, 0], frames)
+
+    co = np.concatenate((old_co[kept], new_co))
+    offsets_left = np.concatenate((old_handles_left.reshape(-1, 2)[kept] - old_co[kept], offsets_left))
+    offsets_right = np.concatenate((old_handles_right.reshape(-1, 2)[kept] - old_co[kept], offsets_right))
+    handle_types_left = np.concatenate((old_handle_types_left[kept], new_handle_types_left))
+    handle_types_right = np.concatenate((old_handle_types_right[kept], new_handle_types_right))
+    interpolations = np.concatenate((old_interpolations[kept], np.full(len(frames), keyframe_interpolation_bezier)))
+
+    order = np.argsort(co[:, 0], kind='stable')
+    co, offsets_left, offsets_right = co[order], offsets_left[order], offsets_right[order]
+    handle_types_left, handle_types_right, interpolations = handle_types_left[order], handle_types_right[order], interpolations[order]
+
+    if not from_maya and len(co) > 1:
+        #handles reach a third of the way to the neighboring keys, their slope scaled by the same spacing
+        spacing = np.abs(np.diff(co[:, 0]))
+        offsets_left[1:] = np.stack((-spacing / 3.0, offsets_left[1:, 1] * spacing / 3.0), axis=1)
+        offsets_right[:-1] = np.stack((spacing / 3.0, offsets_right[:-1, 1] * spacing / 3.0), axis=1)
+
+    keyframe_points.add(len(co) - old_count)
+    keyframe_points.foreach_set('co', co.astype(np.float32).ravel())
+    keyframe_points.foreach_set('handle_left', (co + offsets_left).astype(np.float32).ravel())
+    keyframe_points.foreach_set('handle_right', (co + offsets_right).astype(np.float32).ravel())
+    keyframe_points.foreach_set('handle_left_type', handle_types_left.astype(np.int32))
+    keyframe_points.foreach_set('handle_right_type', handle_types_right.astype(np.int32))
+    keyframe_points.foreach_set('interpolation', interpolations.astype(np.int32))
+    #recalculates the auto handles
+    fcurve.update()
+
+def action_from_maya_anim_format(context, anim_name, anim_records,from_maya, use_brawl_bind):
+    '''
+    anim_records are the records of iter_maya_anim_records. Each channel is written to the action as soon as
+    it's read, so it can be fed straight from the file.
+    '''
 
     #this code fixes the problem where the imported animation may be offseted (rot, loc and/or scale)
     #if the character isn't already in rest pose. I don't know why it happens.
@@ -155,82 +286,70 @@ def action_from_maya_anim_format(context, anim_name, anim_file_lines,from_maya,
 
     context.scene.tool_settings.use_keyframe_insert_auto = prev_auto
 
+    attr_to_component = {'translate' : 'location',\
+                         'rotate' : 'rotation_euler',\
+                         'scale' : 'scale'}
+    axis_to_index = {'X': 0,'x':0, 'Y':1,'y':1,'Z':2,'z':2 , 'W':3,'w':3}
 
-    #remove comments, semicolons and leading and trailing whitespace
-    anim_file_lines = trim_comments(anim_file_lines)
-
-    for i, line in enumerate_start(0, anim_file_lines):
-        anim_file_lines[i] = line.replace(';', '').strip()
-
+    header = {}
+    action = None
     print('extracting header attributes')
-    #group the lines into more convenient structures
-    anim_start_index, header_lines = read_until(0, anim_file_lines, 'anim ')
+    for record in itertools.chain(anim_records, [None]):
+        if record is not None and record[0] == 'header':
+            header[record[1]] = record[2]
+            continue
+
+        if action is None:
+            #the header is complete once the first anim line (or the end of the file) is reached
+            print('parsing header')
+            '''
+            treats start/endTime and Unitless variations as equivalent to frame index.
+            only supports 'deg' and 'rad' angular units
+            '''
+            frame_start = int(header['startTime'] if 'startTime' in header else header['startUnitless'])
+            frame_end = int(header['endTime'] if 'endTime' in header else header['endUnitless'])
+            angular_unit = header['angularUnit']
+            angle_scaling = math.pi/180.0 if 'deg' in angular_unit else 1
 
-    '''
-    treats start/endTime and Unitless variations as equivalent to frame index.
-    only supports 'deg' and 'rad' angular units
-    '''
-    frame_start_line = ''
-    frame_end_line = ''
-    angular_unit_line = ''
-    for line in header_lines:
-        if line.startswith('startTime') or line.startswith('startUnitless'):
-            frame_start_line = line
-        elif line.startswith('endTime') or line.startswith('endUnitless'):
-            frame_end_line = line
-        elif line.startswith('angularUnit'):
-            angular_unit_line = line
-
-    print('extracting animation datas')
-    #(anim_line, [animData attribute lines],[animData key lines] )
-    anim_info_lines = []
-    iterator = enumerate_start(anim_start_index, anim_file_lines)
-    for i, line in iterator:
-        if line.startswith('anim '):
-            anim_line = line
-            animData_attr_lines = None
-            animData_key_lines = None
+            #allows conversion of rads to degrees w/o affecting conversion of translation and scale.
+            component_scaling = {'translate' : 1,\
+                                 'rotate' : angle_scaling,\
+                                 'scale' : 1}
 
-            if anim_file_lines[i+1].startswith('animData'):
-                '''if exists, animData must follow the anim line  according to format specs'''
-                #use same iterator so the current_index of both loops are affected
-                #note that entering this loop gives the next line after 'animData {' as desired
-                i, animData_attr_lines = read_until(i + 2, anim_file_lines,'keys')
-                #note: the next i+1 skips the ' keys' line
-                '''assumes keys open-bracket occurs on same line'''
-                i, animData_key_lines = read_until(i + 1, anim_file_lines,'}')
+            print('creating animation datas')
 
-                iterator.current_index = i + 1
+            #..this operator does not work..
+            #bpy.ops.action.new(context_override)
+            action = context.blend_data.actions.new(anim_name)
 
-            anim_info_lines.append((anim_line, animData_attr_lines, animData_key_lines))
+            if context.active_object.animation_data is None:
+                context.active_object.animation_data_create()
 
+            context.active_object.animation_data.action = action
 
-    print('parsing header')
+            context.scene.frame_preview_start = frame_start
+            context.scene.frame_preview_end = frame_end
+            context.scene.use_preview_range = True
 
-    frame_start = line_value_int(frame_start_line)
-    frame_end = line_value_int(frame_end_line)
-    angular_unit = line_value_str(angular_unit_line)
-    angle_scaling = math.pi/180.0 if 'deg' in angular_unit else 1
-    
-    print('parsing animation datas')
+            '''
+            creating bone groups and fcurves done automatically when bindpose is keyframed. 
+            no need to do that manually anymore.
+            '''
 
-    attr_to_component = {'translate' : 'location',\
-                         'rotate' : 'rotation_euler',\
-                         'scale' : 'scale'}
-    #allows conversion of rads to degrees w/o affecting conversion of translation and scale.
-    component_scaling = {'translate' : 1,\
-                         'rotate' : angle_scaling,\
-                         'scale' : 1}
-    axis_to_index = {'X': 0,'x':0, 'Y':1,'y':1,'Z':2,'z':2 , 'W':3,'w':3}
-    handle_type = {'fixed' : 'FREE', 'auto' : 'AUTO', 'linear':'AUTO'}
+            #replace missing keyframes for the first key of each bone with the bind pose value
+            #since Brawlbox doesn't export the bindpose as a keyframe, it treats bindpose as identity
+            #afterwards, imported keys will overwrite bindpose keys. Missing keyframes will leave the bindpose keys.
+            #-
+            #for exported animations, since BB treats missing keys as bind, we don't have to do so manually again
+            keyframe_bindpose(context,frame_start,use_brawl_bind)
 
-    #(bone_name, channel data path, channel array_index, [key infos])
-    #keyinfo: (key, handle_left, handle_right)
-    #handle: (type, angle, weight)
-    parsed_anim_infos = []
-    for anim_info in anim_info_lines:
-        anim_line = anim_info[0]
-        animData_key_lines = anim_info[2]
+            print('parsing animation datas')
+
+        if record is None:
+            break
+        _, anim_line, animData_key_lines = record
+        if animData_key_lines is None:
+            continue
 
         anim_line_split = anim_line.split(' ')
         anim_line_split_len = len(anim_line_split)
@@ -240,121 +359,48 @@ def action_from_maya_anim_format(context, anim_name, anim_file_lines,from_maya,
             #name may be an attribute name.. or a node name, according to docs
             #tag, name, row, child, attr_index = anim_line_split
             print('warning: line format not supported ({0})'.format(anim_line))
+            continue
         elif anim_line_split_len == 4:
             '''not supported. Insufficient info to determine joint to animate'''
             #tag, row, child, attr_index = anim_line_split
             print('warning: line format not supported ({0})'.format(anim_line))
-        else:
-            tag, attr_full_name, attr_leaf_name, node_name, row, child, attr_index = anim_line_split
+            continue
 
-            attr_name = attr_leaf_name[:-1]
-            array_index = axis_to_index[attr_leaf_name[-1]]
-            if array_index == 3:
-                component = 'rotation_quaternion'
-            else:
-                
-                if attr_name not in attr_to_component:
-                    print('attribute not supported, skipped: ' + anim_line )
-                    continue 
+        tag, attr_full_name, attr_leaf_name, node_name, row, child, attr_index = anim_line_split
 
-                component = attr_to_component[attr_name]
-            key_value_scaling = component_scaling[attr_name]
-            data_path = 'pose.bones[\"{0}\"].{1}'.format(node_name, component)
+        attr_name = attr_leaf_name[:-1]
+        array_index = axis_to_index[attr_leaf_name[-1]]
+        if array_index == 3:
+            component = 'rotation_quaternion'
+        else:
             
-            rest_offset = 0
-            if not use_brawl_bind:
-                rest_transform = bone_rest_transforms.get(node_name)
-                if rest_transform:
-                    if component == 'location':
-                        rest_offset = rest_transform[0][array_index]
-                    elif component == 'rotation_euler':
-                        rest_offset = rest_transform[1][array_index] / key_value_scaling;
-
-            '''
-            currently, i'm going to assume that the imported rotation type and order matches the imported armature data.
-            ...also just going to assume the rotation is euler and order:XYZ ...
-            '''
-            parsed_keyinfos = []
-
-            #(bone_name, channel data path, channel array_index, [key infos])
-            parsed_anim_infos.append((node_name, data_path, array_index, parsed_keyinfos))
-            for key_line in animData_key_lines:
-                key_line_split = key_line.split(' ')
-                key_line_len = len(key_line_split)
-                splice_offset = 0
-                frame, value, type_left, type_right, tan_locked, weight_locked, breakdown= key_line_split[0 + splice_offset: 7 + splice_offset]
-
-                angle_left = '0'
-                weight_left = '0'
-                angle_right = '0'
-                weight_right = '0'
-                
-                value = float(value) - rest_offset
-
-                if type_left == 'fixed':
-                    angle_left, weight_left = key_line_split[7 + splice_offset:9 + splice_offset]
-
-                    if type_right == 'fixed':
-                        angle_right, weight_right = key_line_split[9 + splice_offset:12 + splice_offset]
-
-                elif type_right == 'fixed':
-                    angle_right, weight_right = key_line_split[7 + splice_offset:9 + splice_offset]
+            if attr_name not in attr_to_component:
+                print('attribute not supported, skipped: ' + anim_line )
+                continue 
 
-                #if node_name == 'HipN' and data_path == 'pose.bones["HipN"].location' and array_index==1:
-                #    print('angle:{0} weight:{1}'.format(angle_left,weight_left))
-                #(key, handle_left, handle_right)    
-                parsed_keyinfos.append(((int(frame), value * key_value_scaling),\
-                                        (handle_type[type_left],float(angle_left)* angle_scaling, float(weight_left)),\
-                                        (handle_type[type_right],float(angle_right)* angle_scaling, float(weight_right))))
-
-
-    print('creating animation datas')
-
-    #..this operator does not work..
-    #bpy.ops.action.new(context_override)
-    action = context.blend_data.actions.new(anim_name)
-
-    if context.active_object.animation_data is None:
-        context.active_object.animation_data_create()
-
-    context.active_object.animation_data.action = action
-
-    context.scene.frame_preview_start = frame_start
-    context.scene.frame_preview_end = frame_end
-    context.scene.use_preview_range = True
-
-    '''
-    unique_bone_names = set([info[0] for info in parsed_anim_infos])
-    creating bone groups and fcurves done automatically when bindpose is keyframed. 
-    no need to do that manually anymore.
-    '''
-    #bone_groups = {}
-    #for bone_name in unique_bone_names:
-    #    anim_group = action.groups.new(bone_name)
-    #    anim_group.name = bone_name
-    #    bone_groups[bone_name] = anim_group
-
-    #for channel_info in parsed_anim_infos:
-    #    bone_name = channel_info[0]
-    #    channel_data_path = channel_info[1]
-    #    channel_array_index = channel_info[2]
-
-    #    channel_curve = action.fcurves.new(channel_data_path, index=channel_array_index, action_group=bone_groups[bone_name].name)
-    
+            component = attr_to_component[attr_name]
+        key_value_scaling = component_scaling[attr_name]
+        data_path = 'pose.bones[\"{0}\"].{1}'.format(node_name, component)
+        
+        rest_offset = 0
+        if not use_brawl_bind:
+            rest_transform = bone_rest_transforms.get(node_name)
+            if rest_transform:
+                if component == 'location':
+                    rest_offset = rest_transform[0][array_index]
+                elif component == 'rotation_euler':
+                    rest_offset = rest_transform[1][array_index] / key_value_scaling;
 
-    #replace missing keyframes for the first key of each bone with the bind pose value
-    #since Brawlbox doesn't export the bindpose as a keyframe, it treats bindpose as identity
-    #afterwards, imported keys will overwrite bindpose keys. Missing keyframes will leave the bindpose keys.
-    #-
-    #for exported animations, since BB treats missing keys as bind, we don't have to do so manually again
-    keyframe_bindpose(context,frame_start,use_brawl_bind)
-    
-    for channel_info in parsed_anim_infos:
-        bone_name = channel_info[0]
-        channel_data_path = channel_info[1]
-        channel_array_index = channel_info[2]
-        channel_keyinfos = channel_info[3]
+        '''
+        currently, i'm going to assume that the imported rotation type and order matches the imported armature data.
+        ...also just going to assume the rotation is euler and order:XYZ ...
+        '''
+        frames, values, types_left, types_right, angles_left, weights_left, angles_right, weights_right = \
+            decode_anim_keys(animData_key_lines, rest_offset, key_value_scaling, angle_scaling)
 
+        bone_name = node_name
+        channel_data_path = data_path
+        channel_array_index = array_index
 
         #user:readme:todo:bug: sometimes collada importer misses some bones? Ex: Kirby's HeadItmN bone isn't imported...
         #since that bone seems unimportant, i'm not too worried about it. 
@@ -363,80 +409,8 @@ def action_from_maya_anim_format(context, anim_name, anim_file_lines,from_maya,
 
         channel_curve = [fcurve for fcurve in action.groups[bone_name].channels if ((fcurve.data_path == channel_data_path) and (fcurve.array_index == channel_array_index ))][0]
         #print('{0} {1} {2}'.format(bone_name, channel_data_path, channel_array_index))
-        for key_info in channel_keyinfos:
-            
-            #print(key_info)
-            key = key_info[0]
-            handle_left, handle_right = (key_info[1], key_info[2])
-            handle_left_angle, handle_right_angle = (handle_left[1], handle_right[1])
-            weight_left, weight_right = (handle_left[2], handle_right[2])
-
-            #for rotation componemnts, blender treats writes as if they're in radians, the unit of the rotation component., yet (i think) the ratio is already in degrees/frames
-            handle_left_offset =  [-1, -tan(handle_left_angle)]
-            handle_right_offset = [1, tan(handle_right_angle)]
- 
-            
-            #I think the tangent is given in units of degrees, so we have to convert to rads for blender?
-            if channel_data_path.endswith('rotation_euler'):
-                handle_left_offset[1] = handle_left_offset[1] * (math.pi/180.0)
-                handle_right_offset[1] = handle_right_offset[1] * (math.pi/180.0)
-                
-            #maya testing
-            if from_maya:
-                #https://download.autodesk.com/us/maya/2010help/API/class_m_fn_anim_curve.html
-                ''' 
-                 One important note is how the outgoing and incoming tangents directions for a key are saved internally and in the Maya Ascii file format.
-                 Instead of being specified as points, the tangent directions are specified as vectors. The outgoing tangent direction at P1 is specified and 
-                 saved as the vector 3*(P2 - P1) and the incoming tangent direction is specified and saved as the vector 3*(P4 - P3).
-                '''
-                #(tan1,weight1) -> 3 * (p4-p3) -> 3*(current_co - handle_left)
-                #(tan2,weight2) -> 3 * (p2-p1) -> 3*(handle_right - current_co)
-                #in_vec = Vector((weight_left,handle_left_angle))
-                #out_vec = Vector((weight_right,handle_right_angle))
-                #handle_left_offset = -(in_vec * (1.0/3.0))  
-                #handle_right_offset = (out_vec * (1.0/3.0))  
-                handle_left_offset =  Vector((-1, -tan(handle_left_angle) ))
-                handle_right_offset = Vector((1, tan(handle_right_angle) ))
-    
-                handle_left_offset = handle_left_offset.normalized()* weight_left
-                handle_right_offset = handle_right_offset.normalized()* weight_right
-                
-                if channel_data_path.endswith('rotation_euler'):
-                    handle_left_offset[1] = handle_left_offset[1] * (math.pi/180.0)
-                    handle_right_offset[1] = handle_right_offset[1] * (math.pi/180.0)
-                
-            #if bone_name == 'HipN' and channel_data_path == 'pose.bones["HipN"].rotation_euler' and channel_array_index==1:
-            #    print('F{3} angle:{0} weight:{1} yoffset:{2} '.format(handle_left_angle * 180.0/math.pi,(weight_left-1),handle_left_offset[1],key[0]))
-
-
-
-            key_frame = channel_curve.keyframe_points.insert(key[0],key[1])
-            key_frame.interpolation ='BEZIER'# 'CONSTANT'#'BEZIER'
-            key_frame.co = key
-            #print(key_frame.co)
-            key_frame.handle_left_type = handle_left[0]
-            key_frame.handle_right_type = handle_right[0]
-            
-            if handle_left[0] != 'AUTO':
-                key_frame.handle_left = (key[0] + handle_left_offset[0], key[1] + handle_left_offset[1])
-            if handle_right[0] != 'AUTO':
-                key_frame.handle_right = (key[0] + handle_right_offset[0], key[1] + handle_right_offset[1])
-
-                
-        if not from_maya:
-            for i in range(0,len(channel_curve.keyframe_points)):
-                keyframe = channel_curve.keyframe_points[i]
-                co = keyframe.co 
-
-                if keyframe.handle_left_type != 'AUTO' and i > 0:
-                    keyframe_left = channel_curve.keyframe_points[i-1]
-                    offset = abs(co[0] - keyframe_left.co[0]) 
-                    keyframe.handle_left = (co[0] - (1.0/3.0) * offset ,co[1] + (keyframe.handle_left[1] - co[1]) * offset/3.0 ) 
-                if  keyframe.handle_right_type != 'AUTO' and i < len(channel_curve.keyframe_points) - 1:
-                    keyframe_right = channel_curve.keyframe_points[i+1]
-                    offset = abs(co[0] - keyframe_right.co[0])
-                    keyframe.handle_right = (keyframe_right.co[0] - (2.0/3.0) * (keyframe_right.co[0] - co[0]),co[1] + (keyframe.handle_right[1] - co[1]) * offset/3.0)
-
+        write_anim_channel(channel_curve, frames, values, types_left, types_right, angles_left, weights_left, angles_right, weights_right,
+                           channel_data_path.endswith('rotation_euler'), from_maya)
 
     print('.. finished parsing maya animation')
 
@@ -605,13 +579,9 @@ def brawlbox_anim_import(context, filepath, from_maya, use_brawl_bind):
 
     filename = get_filename(filepath)
 
-    print('reading in file..' + filename)
+    print('reading in file and converting to action..' + filename)
     with open(filepath, 'r', encoding='utf-8') as f:
-        anim_file_lines = f.readlines()
-    print('finished reading file')
-
-    print("converting to action..")
-    action = action_from_maya_anim_format(context, filename, anim_file_lines,from_maya, use_brawl_bind)
+        action = action_from_maya_anim_format(context, filename, iter_maya_anim_records(f),from_maya, use_brawl_bind)
     print("... finished converting to action")
 
     print('.. finished importing maya animation: ' + filename)
@@ -1041,26 +1011,6 @@ class ContextOverride(dict):
         super(ContextOverride, self).__init__(*args, **kwargs)
         self.__dict__ = self
         self.update(context.copy())
-class enumerate_start:
-    def __init__(self, start_index, collection):
-        self.current_index = start_index
-        self.collection = collection
-        self.end_index = len(collection)
-
-    def __iter__(self):
-        return self
-
-    def __next__(self): # Python 3: def __next__(self)
-        if self.current_index >= self.end_index:
-            raise StopIteration
-        else:
-            current_element = self.collection[self.current_index]
-            result = (self.current_index, current_element)
-            self.current_index += 1
-
-            return result
-    # python2.x compatibility.
-    next = __next__
 #class POSE_OT_apply_inverse_bind_pose_to_action(Operator):
 #
 #    bl_idname = "brawlbox.apply_inverse_bind_pose_to_action"
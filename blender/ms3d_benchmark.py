@@ -0,0 +1,155 @@
+"""Synthetic ms3d files and an import benchmark for ms3d_import.py
+
+Writes synthetic ms3d files across a size sweep and imports each with import_ms3d, timing
+its phases (parse, materials, bones, fcurves, split, mesh, skinning, modifiers) with an
+ImportTimer, printing one JSON object per run and optionally writing all of them to --output.
+
+Run headless inside blender (arguments after --):
+    blender --background --factory-startup --python ms3d_benchmark.py -- --sizes 1000 10000 100000
+When bpy can't be imported (plain python) only the parse stage is timed.
+
+Author:
+    Minon - Mar.9.2023
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ms3d_format import (MS3DGroup, MS3DJoint, MS3DMaterial, MS3DModel, keyframeDtype,
+    load_ms3d, triangleDtype, vertexDtype, write_ms3d)
+
+try:
+    import bpy
+    from ms3d_import import ImportTimer, import_ms3d
+except ImportError:
+    bpy = None
+
+def synthetic_model(vertexCount, triangleCount, groupCount=1, materialCount=1, jointCount=1,
+                    keyframeCount=0, comments=False, seed=0):
+    """Builds a valid MS3DModel of random data with the given counts"""
+    rng = np.random.default_rng(seed)
+    model = MS3DModel()
+    model.animFps = 30.0
+    model.totalFrames = keyframeCount
+
+    #a grid of vertexes, two triangles per cell, so every triangle is unique
+    columns = max(int(np.ceil(np.sqrt(vertexCount))), 2)
+    rows = vertexCount // columns
+    cells = max(columns - 1, 0) * max(rows - 1, 0)
+    if triangleCount > 2 * cells:
+        raise ValueError('{0} vertices fit {1} unique triangles, not {2}'.format(vertexCount, 2 * cells, triangleCount))
+    model.vertices = np.zeros(vertexCount, vertexDtype)
+    grid = np.arange(vertexCount)
+    model.vertices['pos'][:, 0] = (grid % columns) * (20.0 / columns) - 10.0
+    model.vertices['pos'][:, 1] = (grid // columns) * (20.0 / columns) - 10.0
+    model.vertices['pos'][:, 2] = rng.uniform(-1.0, 1.0, vertexCount)
+    model.vertices['boneId'] = rng.integers(0, jointCount, vertexCount) if jointCount else -1
+
+    model.triangles = np.zeros(triangleCount, triangleDtype)
+    corners = (np.arange(rows - 1)[:, None] * columns + np.arange(columns - 1)).ravel() if cells else np.zeros(0, int)
+    quads = np.stack((corners, corners + 1, corners + columns + 1, corners + columns), axis=1)
+    model.triangles['indexes'] = np.concatenate((quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]), axis=1).reshape(-1, 3)[:triangleCount]
+    normals = rng.normal(size=(triangleCount, 3, 3))
+    model.triangles['normals'] = normals / np.linalg.norm(normals, axis=2, keepdims=True)
+    model.triangles['u'] = rng.uniform(0.0, 1.0, (triangleCount, 3))
+    model.triangles['v'] = rng.uniform(0.0, 1.0, (triangleCount, 3))
+    model.triangles['smoothGroup'] = rng.integers(1, 5, triangleCount)
+    model.triangles['groupIndex'] = np.arange(triangleCount) % max(groupCount, 1)
+
+    for i in range(groupCount):
+        model.groups.append(MS3DGroup(name='group' + str(i), materialIndex=i % materialCount if materialCount else -1,
+            comment='group comment ' + str(i) if comments else ''))
+
+    #distinct colors, so no two materials are deduplicated
+    for i in range(materialCount):
+        shade = (i + 1) / (materialCount + 1)
+        model.materials.append(MS3DMaterial(name='material' + str(i), diffuse=(shade, 0.5, 1.0 - shade, 1.0),
+            shininess=float(i % 128), comment='material comment ' + str(i) if comments else ''))
+
+    model.rotKeys = np.zeros(jointCount * keyframeCount, keyframeDtype)
+    model.transKeys = np.zeros(jointCount * keyframeCount, keyframeDtype)
+    times = np.arange(1, keyframeCount + 1) / model.animFps
+    for i in range(jointCount):
+        rotKeys = model.rotKeys[i * keyframeCount:(i + 1) * keyframeCount]
+        transKeys = model.transKeys[i * keyframeCount:(i + 1) * keyframeCount]
+        rotKeys['time'] = times
+        rotKeys['value'] = np.cumsum(rng.normal(0.0, 0.1, (keyframeCount, 3)), axis=0)
+        transKeys['time'] = times
+        transKeys['value'] = rng.normal(0.0, 0.1, (keyframeCount, 3))
+        model.joints.append(MS3DJoint(
+            name='joint' + str(i),
+            parentName='joint' + str(rng.integers(0, i)) if i else '',
+            rotation=tuple(rng.uniform(-0.5, 0.5, 3).tolist()),
+            position=tuple(rng.uniform(-1.0, 1.0, 3).tolist()),
+            rotKeys=rotKeys,
+            transKeys=transKeys,
+            comment='joint comment ' + str(i) if comments else ''))
+
+    if comments and keyframeCount:
+        #four clips spanning the animation
+        bounds = np.linspace(1, keyframeCount, 5).astype(int)
+        model.modelComment = '\n'.join('anim clip{0} {1} {2}'.format(i, bounds[i], bounds[i + 1]) for i in range(4))
+    return model
+
+def benchmark_file(filepath):
+    """Imports a file with import_ms3d, returning the seconds spent in each of its phases"""
+    if bpy is None:
+        start = time.perf_counter()
+        load_ms3d(filepath)
+        return {'parse': time.perf_counter() - start}
+    bpy.ops.wm.read_factory_settings(use_empty=True)
+    timer = ImportTimer()
+    import_ms3d(filepath, timer=timer)
+    return dict(timer.seconds)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 60000], help='triangle counts to sweep')
+    parser.add_argument('--groups', type=int, default=4)
+    parser.add_argument('--materials', type=int, default=4)
+    parser.add_argument('--joints', type=int, default=50)
+    parser.add_argument('--keyframes', type=int, default=100, help='rotation and translation keys per joint')
+    parser.add_argument('--comments', action='store_true', help='add group, material, joint and model comments')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per size')
+    parser.add_argument('--directory', default=None, help='where to keep the synthetic files, a temporary directory by default')
+    parser.add_argument('--output', default=None, help='write all results to this JSON file')
+    args = parser.parse_args(argv)
+
+    directory = args.directory or tempfile.mkdtemp(prefix='ms3d_benchmark')
+    os.makedirs(directory, exist_ok=True)
+    results = []
+    for size in args.sizes:
+        #ms3d counts are 16 bit
+        triangleCount = min(size, 65535)
+        #enough grid vertices for the triangles, see synthetic_model
+        vertexCount = min(triangleCount // 2 + 4 * int(np.sqrt(triangleCount)) + 8, 65535)
+        filepath = os.path.join(directory, 'synthetic_{0}.ms3d'.format(triangleCount))
+        write_ms3d(filepath, synthetic_model(vertexCount, triangleCount, args.groups, args.materials,
+            args.joints, args.keyframes, args.comments))
+        for run in range(args.repeat):
+            result = {
+                'file': filepath,
+                'bytes': os.path.getsize(filepath),
+                'vertices': vertexCount,
+                'triangles': triangleCount,
+                'groups': args.groups,
+                'materials': args.materials,
+                'joints': args.joints,
+                'keyframes': args.keyframes,
+                'run': run,
+                'seconds': benchmark_file(filepath),
+            }
+            print(json.dumps(result))
+            results.append(result)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=1)
+    return results
+
+if __name__ == "__main__":
+    main(sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:])
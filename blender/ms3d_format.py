@@ -0,0 +1,778 @@
+"""Blender-independent reader for Milkshape3D ms3d files
+
+Parses a file into an MS3DModel whose vertex, triangle and keyframe data live
+in contiguous NumPy structured arrays, so files can be parsed, validated and
+benchmarked without a running Blender (e.g. in worker processes).
+Values are kept exactly as stored in the file; axis conversion is left to the caller.
+
+Author:
+    Minon - Mar.9.2023
+"""
+import copy
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import time
+import numpy as np
+
+#fixed-size ms3d records, decoded in bulk straight from the mapped file
+vertexDtype = np.dtype([
+    ('flags', 'u1'),
+    ('pos', '<f4', (3,)),
+    ('boneId', 'i1'), #-1 when the vertex isn't attached to a joint
+    ('refCount', 'u1'),
+])
+triangleDtype = np.dtype([
+    ('flags', '<u2'),
+    ('indexes', '<u2', (3,)),
+    ('normals', '<f4', (3, 3)),
+    ('u', '<f4', (3,)), #uvs are stored in order u0, u1, u2, v0, v1, v2
+    ('v', '<f4', (3,)),
+    ('smoothGroup', 'u1'),
+    ('groupIndex', 'u1'),
+])
+keyframeDtype = np.dtype([
+    ('time', '<f4'),
+    ('value', '<f4', (3,)),
+])
+#vertex extra records by sub-version, adding up to three more bones per vertex
+vertexExDtypes = {
+    1: np.dtype([('boneIds', 'i1', (3,)), ('weights', 'u1', (3,))]), #weights out of 255
+    2: np.dtype([('boneIds', 'i1', (3,)), ('weights', 'u1', (3,)), ('extra', '<u4', (1,))]), #weights out of 100
+    3: np.dtype([('boneIds', 'i1', (3,)), ('weights', 'u1', (3,)), ('extra', '<u4', (2,))]),
+}
+int8Layout = struct.Struct('<b')
+int16Layout = struct.Struct('<H')
+int32Layout = struct.Struct('<i')
+floatLayout = struct.Struct('<f')
+materialLayout = struct.Struct('<32s4f4f4f4fffB128s128s')
+jointLayout = struct.Struct('<B32s32s3f3fHH')
+jointExLayout = struct.Struct('<3f') #color
+modelExLayout = struct.Struct('<fif') #jointSize, transparencyMode, alphaRef
+#joint and model extra sub-versions with the layouts above
+jointExSubVersions = (1,)
+modelExSubVersions = (1,)
+
+class MS3DError(Exception):
+    """Raised when a file isn't a readable ms3d file"""
+
+def decodeString(data):
+    s = data.split(b'\0')[0].decode('ascii')
+    s.encode('utf-8', 'strict')
+    return s
+
+def flipYZ(vectors):
+    """Converts (x, y, z) rows to (x, -z, y)"""
+    flipped = vectors[..., [0, 2, 1]]
+    flipped[..., 1] *= -1
+    return flipped
+
+def unflipYZ(vectors):
+    """Converts (x, y, z) rows to (x, z, -y), undoing flipYZ"""
+    flipped = vectors[..., [0, 2, 1]]
+    flipped[..., 2] *= -1
+    return flipped
+
+def parseClips(comment):
+    """Returns (name, startFrame, endFrame) for every 'anim <name> <startFrame> [endFrame]' line"""
+    clips = []
+    for line in comment.splitlines():
+        data = line.split()
+        if len(data) > 2 and data[0] == 'anim':
+            startFrame = int(data[2])
+            #endFrame is optional, making it a single frame when omitted
+            if len(data) > 3:
+                endFrame = int(data[3])
+            else:
+                endFrame = startFrame
+            clips.append((data[1], startFrame, endFrame))
+    return clips
+
+def formatClips(clips):
+    """Model comment holding an 'anim <name> <startFrame> <endFrame>' line per clip, read back by parseClips"""
+    return '\n'.join('anim {0} {1} {2}'.format('_'.join(name.split()), startFrame, endFrame)
+        for name, startFrame, endFrame in clips)
+
+def parseMaterialInputs(comment):
+    """Returns (inputName, texturePath) for every '<inputName>=<texture filepath>' line"""
+    inputs = []
+    for line in comment.splitlines():
+        i_space = line.find('=')
+        if i_space > 0:
+            inputs.append((line[0:i_space], line[i_space+1:]))
+    return inputs
+
+def formatMaterialInputs(inputs):
+    """Material comment holding an '<inputName>=<texture filepath>' line per input, read back by parseMaterialInputs"""
+    return '\n'.join(inputName + '=' + path for inputName, path in inputs)
+
+class MS3DReader:
+    """Sequential reader over an in-memory ms3d buffer"""
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.offset = 0
+
+    def remaining(self):
+        return len(self.buffer) - self.offset
+
+    def unpack(self, layout):
+        if self.offset + layout.size > len(self.buffer):
+            raise MS3DError('unexpected end of file at offset ' + str(self.offset))
+        values = layout.unpack_from(self.buffer, self.offset)
+        self.offset += layout.size
+        return values
+
+    def skip(self, length):
+        if self.offset + length > len(self.buffer):
+            raise MS3DError('unexpected end of file at offset ' + str(self.offset))
+        self.offset += length
+
+    def readInt8(self):
+        return self.unpack(int8Layout)[0]
+
+    def readInt16(self):
+        return self.unpack(int16Layout)[0]
+
+    def readInt(self):
+        return self.unpack(int32Layout)[0]
+
+    def readFloat(self):
+        return self.unpack(floatLayout)[0]
+
+    def readBytes(self, length):
+        if self.offset + length > len(self.buffer):
+            raise MS3DError('unexpected end of file at offset ' + str(self.offset))
+        data = bytes(self.buffer[self.offset:self.offset + length])
+        self.offset += length
+        return data
+
+    def readString(self, length):
+        return decodeString(self.readBytes(length))
+
+    def readRecords(self, dtype, count):
+        if self.offset + dtype.itemsize * count > len(self.buffer):
+            raise MS3DError('unexpected end of file at offset ' + str(self.offset))
+        #copy so the records outlive the mapped file
+        records = np.frombuffer(self.buffer, dtype, count, self.offset).copy()
+        self.offset += dtype.itemsize * count
+        return records
+
+class MS3DGroup:
+    __slots__ = ('flags', 'name', 'triangleIndexes', 'materialIndex', 'comment')
+
+    def __init__(self, flags=0, name='', triangleIndexes=None, materialIndex=-1, comment=''):
+        self.flags = flags
+        self.name = name
+        self.triangleIndexes = triangleIndexes
+        self.materialIndex = materialIndex #-1 when unassigned
+        self.comment = comment
+
+class MS3DMaterial:
+    __slots__ = ('name', 'ambient', 'diffuse', 'specular', 'emissive', 'shininess',
+                 'transparency', 'mode', 'texture', 'alphamap', 'comment')
+
+    def __init__(self, name='', ambient=(0.0, 0.0, 0.0, 1.0), diffuse=(1.0, 1.0, 1.0, 1.0),
+                 specular=(0.0, 0.0, 0.0, 1.0), emissive=(0.0, 0.0, 0.0, 1.0), shininess=0.0,
+                 transparency=1.0, mode=0, texture='', alphamap='', comment=''):
+        self.name = name
+        self.ambient = ambient
+        self.diffuse = diffuse
+        self.specular = specular
+        self.emissive = emissive
+        self.shininess = shininess
+        self.transparency = transparency
+        self.mode = mode
+        self.texture = texture
+        self.alphamap = alphamap
+        self.comment = comment
+
+class MS3DJoint:
+    __slots__ = ('flags', 'name', 'parentName', 'rotation', 'position', 'rotKeys', 'transKeys', 'comment', 'color')
+
+    def __init__(self, flags=0, name='', parentName='', rotation=(0.0, 0.0, 0.0), position=(0.0, 0.0, 0.0),
+                 rotKeys=None, transKeys=None, comment='', color=None):
+        self.flags = flags
+        self.name = name
+        self.parentName = parentName
+        self.rotation = rotation #local euler rotation in radians
+        self.position = position #local position
+        #keyframeDtype views into MS3DModel.rotKeys/transKeys, times are in seconds
+        self.rotKeys = rotKeys if rotKeys is not None else np.empty(0, keyframeDtype)
+        self.transKeys = transKeys if transKeys is not None else np.empty(0, keyframeDtype)
+        self.comment = comment
+        self.color = color #from the joint extra section, None when the file has none
+
+class MS3DModel:
+    """Contents of an ms3d file, with per-vertex/triangle/keyframe data in structured arrays"""
+    __slots__ = ('vertices', 'triangles', 'groups', 'materials', 'animFps', 'currentTime',
+                 'totalFrames', 'joints', 'rotKeys', 'transKeys', 'subVersion', 'modelComment',
+                 'vertexExtras', 'vertexExSubVersion', 'jointExSubVersion', 'jointSize', 'transparencyMode',
+                 'alphaRef', 'modelExSubVersion')
+
+    def __init__(self):
+        self.vertices = np.empty(0, vertexDtype)
+        self.triangles = np.empty(0, triangleDtype)
+        self.groups = []
+        self.materials = []
+        self.animFps = 24.0
+        self.currentTime = 0.0
+        self.totalFrames = 0
+        self.joints = []
+        #keyframes of all joints, contiguous in joint order
+        self.rotKeys = np.empty(0, keyframeDtype)
+        self.transKeys = np.empty(0, keyframeDtype)
+        self.subVersion = 0 #comment section sub-version, 0 when the file has no comments
+        self.modelComment = ''
+        #optional trailing sections, a sub-version of 0 means the file doesn't have them
+        self.vertexExtras = np.empty(0, vertexExDtypes[1]) #one vertexExDtypes[vertexExSubVersion] record per vertex
+        self.vertexExSubVersion = 0
+        self.jointExSubVersion = 0 #joint extras are stored as MS3DJoint.color
+        self.jointSize = 1.0
+        self.transparencyMode = 0
+        self.alphaRef = 0.0
+        self.modelExSubVersion = 0
+
+    def __getstate__(self):
+        #joints' keyframes are views into rotKeys/transKeys, so only their counts are pickled
+        state = {name: getattr(self, name) for name in self.__slots__}
+        joints = []
+        for joint in self.joints:
+            joint = copy.copy(joint)
+            joint.rotKeys = len(joint.rotKeys)
+            joint.transKeys = len(joint.transKeys)
+            joints.append(joint)
+        state['joints'] = joints
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        rotStart = 0
+        transStart = 0
+        for joint in self.joints:
+            rotCount, transCount = joint.rotKeys, joint.transKeys
+            joint.rotKeys = self.rotKeys[rotStart:rotStart + rotCount]
+            joint.transKeys = self.transKeys[transStart:transStart + transCount]
+            rotStart += rotCount
+            transStart += transCount
+
+def readKeyframeRuns(reader, runs):
+    """Gathers (offset, count) keyframe runs into one contiguous array"""
+    total = sum(count for offset, count in runs)
+    keys = np.empty(total, keyframeDtype)
+    keyViews = []
+    start = 0
+    for offset, count in runs:
+        keys[start:start + count] = np.frombuffer(reader.buffer, keyframeDtype, count, offset)
+        keyViews.append(keys[start:start + count])
+        start += count
+    return keys, keyViews
+
+def readHeader(reader):
+    #read header
+    if reader.remaining() < 14 or reader.readBytes(10) != b'MS3D000000':
+        raise MS3DError('invalid header')
+
+    #read file version
+    fileVersion = reader.readInt()
+    if fileVersion != 4:
+        raise MS3DError('invalid file version: ' + str(fileVersion))
+    return fileVersion
+
+def read_model(reader, readGroupTriangles=False, animationOnly=False):
+    """Decodes an ms3d file from a reader positioned at the start of the buffer
+    
+    Each group's triangle index list is skipped unless readGroupTriangles is set,
+    since every triangle already stores the index of its group.
+    With animationOnly, vertex, triangle, group and material records are seeked over,
+    leaving the model with only its animation settings, joints and model comment.
+    """
+    model = MS3DModel()
+    readInt16 = reader.readInt16
+    readString = reader.readString
+
+    readHeader(reader)
+
+    if animationOnly:
+        vertCount = readInt16()
+        reader.skip(vertexDtype.itemsize * vertCount)
+        reader.skip(triangleDtype.itemsize * readInt16())
+        for i in range(readInt16()):
+            reader.skip(33) #flags, name
+            reader.skip(readInt16() * 2 + 1) #triangle indexes, material index
+        reader.skip(materialLayout.size * readInt16())
+        return readAnimation(reader, model, vertCount, animationOnly)
+
+    #read vertices
+    vertCount = readInt16()
+    model.vertices = reader.readRecords(vertexDtype, vertCount)
+
+    #read triangles
+    triCount = readInt16()
+    model.triangles = reader.readRecords(triangleDtype, triCount)
+
+    #read groups
+    groupCount = readInt16()
+    for i in range(groupCount):
+        group = MS3DGroup()
+        group.flags = reader.readInt8() & 0xff
+        group.name = readString(32)
+        gTriCount = readInt16() #triangles in group
+        if readGroupTriangles:
+            group.triangleIndexes = reader.readRecords(np.dtype('<u2'), gTriCount)
+        else:
+            reader.skip(gTriCount * 2)
+        group.materialIndex = reader.readInt8()
+        model.groups.append(group)
+
+    #read materials
+    matCount = readInt16()
+    for i in range(matCount):
+        values = reader.unpack(materialLayout)
+        model.materials.append(MS3DMaterial(
+            name=decodeString(values[0]),
+            ambient=values[1:5],
+            diffuse=values[5:9],
+            specular=values[9:13],
+            emissive=values[13:17],
+            shininess=values[17], #specular power
+            transparency=values[18], #alpha
+            mode=values[19], #spheremapping and such, I think
+            texture=decodeString(values[20]), #diffuse texture filepath
+            alphamap=decodeString(values[21]), #alphablend(probably) texture filepath
+        ))
+    return readAnimation(reader, model, vertCount)
+
+def readAnimation(reader, model, vertCount, animationOnly=False):
+    """Reads everything after the materials: animation settings, joints, comments and extras"""
+    readInt = reader.readInt
+    readInt16 = reader.readInt16
+    readString = reader.readString
+
+    #read animation config
+    model.animFps = reader.readFloat()
+    model.currentTime = reader.readFloat() #current time on timeline
+    model.totalFrames = readInt()
+
+    #read joints (skeleton), keyframes are gathered afterwards so they end up contiguous
+    jointCount = readInt16()
+    rotRuns = []
+    transRuns = []
+    for i in range(jointCount):
+        values = reader.unpack(jointLayout)
+        rotKfCount, transKfCount = values[9:11]
+        rotRuns.append((reader.offset, rotKfCount))
+        reader.skip(keyframeDtype.itemsize * rotKfCount)
+        transRuns.append((reader.offset, transKfCount))
+        reader.skip(keyframeDtype.itemsize * transKfCount)
+        model.joints.append(MS3DJoint(
+            flags=values[0],
+            name=decodeString(values[1]),
+            parentName=decodeString(values[2]),
+            rotation=values[3:6],
+            position=values[6:9],
+        ))
+    model.rotKeys, rotViews = readKeyframeRuns(reader, rotRuns)
+    model.transKeys, transViews = readKeyframeRuns(reader, transRuns)
+    for joint, rotKeys, transKeys in zip(model.joints, rotViews, transViews):
+        joint.rotKeys = rotKeys
+        joint.transKeys = transKeys
+
+    #read comments
+    if reader.remaining() < 4:
+        return model
+    model.subVersion = readInt()
+    if model.subVersion == 1:
+        for items in (model.groups, model.materials, model.joints):
+            count = readInt()
+            for i in range(count):
+                index = readInt()
+                length = readInt()
+                comment = readString(length)
+                if 0 <= index < len(items):
+                    items[index].comment = comment
+        count = readInt() #should be 1 at most
+        for i in range(count):
+            length = readInt()
+            model.modelComment = readString(length)
+    else:
+        #unknown comment layout, so the sections after it can't be found
+        return model
+
+    #read the extra sections, stopping at the first unknown or truncated one
+    #read vertex extras, holding the additional bones and weights of each vertex
+    if reader.remaining() < 4:
+        return model
+    vertexExSubVersion = readInt()
+    if vertexExSubVersion not in vertexExDtypes or reader.remaining() < vertexExDtypes[vertexExSubVersion].itemsize * vertCount:
+        return model
+    if animationOnly:
+        reader.skip(vertexExDtypes[vertexExSubVersion].itemsize * vertCount)
+    else:
+        model.vertexExtras = reader.readRecords(vertexExDtypes[vertexExSubVersion], vertCount)
+        model.vertexExSubVersion = vertexExSubVersion
+
+    #read joint extras
+    if reader.remaining() < 4:
+        return model
+    jointExSubVersion = readInt()
+    if jointExSubVersion not in jointExSubVersions or reader.remaining() < jointExLayout.size * len(model.joints):
+        return model
+    colors = [reader.unpack(jointExLayout) for joint in model.joints]
+    for joint, color in zip(model.joints, colors):
+        joint.color = color
+    model.jointExSubVersion = jointExSubVersion
+
+    #read model extras
+    if reader.remaining() < 4:
+        return model
+    modelExSubVersion = readInt()
+    if modelExSubVersion not in modelExSubVersions or reader.remaining() < modelExLayout.size:
+        return model
+    model.jointSize, model.transparencyMode, model.alphaRef = reader.unpack(modelExLayout)
+    model.modelExSubVersion = modelExSubVersion
+    return model
+
+def vertexWeights(model):
+    """Returns (vertexIndexes, boneIds, weights) arrays of every vertex's bone influences
+    
+    Combines each vertex's own bone with the up to three of its vertex extra record,
+    dropping unattached and zero weight influences and summing repeated bones.
+    Without vertex extras every vertex has its own bone at full weight.
+    """
+    vertexCount = len(model.vertices)
+    boneIds = model.vertices['boneId'].astype(np.int32)[:, None]
+    weights = np.ones((vertexCount, 1), np.float32)
+    if model.vertexExSubVersion and len(model.vertexExtras) == vertexCount:
+        extras = model.vertexExtras
+        maxWeight = 255.0 if model.vertexExSubVersion == 1 else 100.0
+        boneIds = np.concatenate([boneIds, extras['boneIds'].astype(np.int32)], axis=1)
+        #the fourth bone gets whatever weight the first three leave
+        weights = np.empty((vertexCount, 4), np.float32)
+        weights[:, :3] = extras['weights']
+        weights[:, 3] = maxWeight - weights[:, :3].sum(axis=1)
+        #all zero weights mean the vertex follows its own bone alone
+        weights[~extras['weights'].any(axis=1)] = (maxWeight, 0.0, 0.0, 0.0)
+        weights = np.maximum(weights, 0.0) / maxWeight
+    vertexIndexes = np.repeat(np.arange(vertexCount, dtype=np.int64), boneIds.shape[1])
+    boneIds = boneIds.ravel()
+    weights = weights.ravel()
+    used = (boneIds >= 0) & (weights > 0.0)
+    #bone ids are int8, so (vertex, bone) pairs fit in one key
+    keys, inverse = np.unique(vertexIndexes[used] * 128 + boneIds[used], return_inverse=True)
+    weights = np.bincount(inverse, weights[used], len(keys)).astype(np.float32)
+    return (keys // 128).astype(np.int32), (keys % 128).astype(np.int32), weights
+
+def mapFile(filepath):
+    """Maps a whole file read-only"""
+    with open(filepath, 'rb') as file:
+        try:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise MS3DError('empty file')
+
+def load_ms3d(filepath, readGroupTriangles=False, animationOnly=False):
+    """Reads an ms3d file into an MS3DModel, raising MS3DError if it can't be read"""
+    #map the whole file once, records are decoded in bulk from the mapping
+    buffer = mapFile(filepath)
+    try:
+        return read_model(MS3DReader(buffer), readGroupTriangles, animationOnly)
+    finally:
+        buffer.close()
+
+class MS3DInfo:
+    """Counts, animation settings and model comment of an ms3d file"""
+    __slots__ = ('fileVersion', 'vertexCount', 'triangleCount', 'groupCount', 'materialCount',
+                 'jointCount', 'rotKeyCount', 'transKeyCount', 'animFps', 'currentTime',
+                 'totalFrames', 'subVersion', 'modelComment', 'vertexExSubVersion')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+        self.modelComment = ''
+
+    @property
+    def frameRange(self):
+        #milkshape counts frames from 1
+        return (1, self.totalFrames)
+
+def read_info(reader):
+    """Reads an MS3DInfo, skipping over every record instead of decoding it"""
+    info = MS3DInfo()
+    readInt = reader.readInt
+    readInt16 = reader.readInt16
+
+    info.fileVersion = readHeader(reader)
+    info.vertexCount = readInt16()
+    reader.skip(vertexDtype.itemsize * info.vertexCount)
+    info.triangleCount = readInt16()
+    reader.skip(triangleDtype.itemsize * info.triangleCount)
+    info.groupCount = readInt16()
+    for i in range(info.groupCount):
+        reader.skip(33) #flags, name
+        reader.skip(readInt16() * 2 + 1) #triangle indexes, material index
+    info.materialCount = readInt16()
+    reader.skip(materialLayout.size * info.materialCount)
+    info.animFps = reader.readFloat()
+    info.currentTime = reader.readFloat()
+    info.totalFrames = readInt()
+    info.jointCount = readInt16()
+    for i in range(info.jointCount):
+        reader.skip(jointLayout.size - 4) #everything up to the keyframe counts
+        rotKfCount = readInt16()
+        transKfCount = readInt16()
+        info.rotKeyCount += rotKfCount
+        info.transKeyCount += transKfCount
+        reader.skip(keyframeDtype.itemsize * (rotKfCount + transKfCount))
+
+    if reader.remaining() < 4:
+        return info
+    info.subVersion = readInt()
+    if info.subVersion == 1:
+        #group, material and joint comments
+        for i in range(3):
+            for j in range(readInt()):
+                reader.skip(4) #index
+                reader.skip(readInt())
+        if readInt() > 0: #should be 1 at most
+            info.modelComment = reader.readString(readInt())
+        if reader.remaining() >= 4:
+            info.vertexExSubVersion = readInt()
+    return info
+
+def probe_ms3d(filepath):
+    """Reads only the metadata of an ms3d file, seeking over its vertex, triangle, material and keyframe records"""
+    #only the pages holding counts and comments are ever read from the mapping
+    buffer = mapFile(filepath)
+    try:
+        return read_info(MS3DReader(buffer))
+    finally:
+        buffer.close()
+
+def encodeString(s, length):
+    return s.encode('ascii', 'replace')[:length - 1].ljust(length, b'\0')
+
+def encode_model(model):
+    """Encodes an MS3DModel as the contents of an ms3d file"""
+    chunks = [b'MS3D000000', int32Layout.pack(4)]
+
+    #vertices and triangles are written straight from their structured arrays
+    chunks.append(int16Layout.pack(len(model.vertices)))
+    chunks.append(np.ascontiguousarray(model.vertices, vertexDtype).tobytes())
+    chunks.append(int16Layout.pack(len(model.triangles)))
+    chunks.append(np.ascontiguousarray(model.triangles, triangleDtype).tobytes())
+
+    #groups, deriving triangle lists from the triangles' group indexes where they weren't read
+    groupIndex = model.triangles['groupIndex']
+    order = np.argsort(groupIndex, kind='stable').astype('<u2')
+    counts = np.bincount(groupIndex, minlength=len(model.groups))
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    chunks.append(int16Layout.pack(len(model.groups)))
+    for i, group in enumerate(model.groups):
+        triangleIndexes = group.triangleIndexes
+        if triangleIndexes is None:
+            triangleIndexes = order[starts[i]:ends[i]]
+        chunks.append(struct.pack('<B32sH', group.flags, encodeString(group.name, 32), len(triangleIndexes)))
+        chunks.append(np.ascontiguousarray(triangleIndexes, '<u2').tobytes())
+        chunks.append(int8Layout.pack(group.materialIndex))
+
+    chunks.append(int16Layout.pack(len(model.materials)))
+    for material in model.materials:
+        chunks.append(materialLayout.pack(encodeString(material.name, 32),
+            *material.ambient, *material.diffuse, *material.specular, *material.emissive,
+            material.shininess, material.transparency, material.mode,
+            encodeString(material.texture, 128), encodeString(material.alphamap, 128)))
+
+    chunks.append(struct.pack('<ffi', model.animFps, model.currentTime, model.totalFrames))
+
+    chunks.append(int16Layout.pack(len(model.joints)))
+    for joint in model.joints:
+        chunks.append(jointLayout.pack(joint.flags, encodeString(joint.name, 32), encodeString(joint.parentName, 32),
+            *joint.rotation, *joint.position, len(joint.rotKeys), len(joint.transKeys)))
+        chunks.append(np.ascontiguousarray(joint.rotKeys, keyframeDtype).tobytes())
+        chunks.append(np.ascontiguousarray(joint.transKeys, keyframeDtype).tobytes())
+
+    #comments, null-terminated
+    chunks.append(int32Layout.pack(1))
+    for items in (model.groups, model.materials, model.joints):
+        comments = [(i, item.comment.encode('ascii', 'replace') + b'\0') for i, item in enumerate(items) if item.comment]
+        chunks.append(int32Layout.pack(len(comments)))
+        for i, comment in comments:
+            chunks.append(struct.pack('<ii', i, len(comment)))
+            chunks.append(comment)
+    if model.modelComment:
+        comment = model.modelComment.encode('ascii', 'replace') + b'\0'
+        chunks.append(struct.pack('<ii', 1, len(comment)))
+        chunks.append(comment)
+    else:
+        chunks.append(int32Layout.pack(0))
+
+    #extra sections, each only following the one before it
+    if model.vertexExSubVersion not in vertexExDtypes or len(model.vertexExtras) != len(model.vertices):
+        return b''.join(chunks)
+    chunks.append(int32Layout.pack(model.vertexExSubVersion))
+    chunks.append(np.ascontiguousarray(model.vertexExtras, vertexExDtypes[model.vertexExSubVersion]).tobytes())
+    if not model.jointExSubVersion:
+        return b''.join(chunks)
+    chunks.append(int32Layout.pack(model.jointExSubVersion))
+    for joint in model.joints:
+        chunks.append(jointExLayout.pack(*(joint.color or (0.0, 0.0, 0.0))))
+    if not model.modelExSubVersion:
+        return b''.join(chunks)
+    chunks.append(int32Layout.pack(model.modelExSubVersion))
+    chunks.append(modelExLayout.pack(model.jointSize, model.transparencyMode, model.alphaRef))
+    return b''.join(chunks)
+
+def write_ms3d(filepath, model):
+    """Writes an MS3DModel as an ms3d file in a single buffered write"""
+    data = encode_model(model)
+    with open(filepath, 'wb') as file:
+        file.write(data)
+
+def fileHash(filepath):
+    """blake2b digest of a file's contents"""
+    buffer = mapFile(filepath)
+    try:
+        return hashlib.blake2b(buffer, digest_size=16).hexdigest()
+    finally:
+        buffer.close()
+
+class MS3DCache:
+    """Size-bounded, least recently used on-disk cache of decoded MS3DModels
+    
+    Each entry is a directory named after the file's path, size and mtime, holding the
+    vertex, triangle, keyframe and vertex extra arrays as .npy files (loaded memory-mapped on a hit)
+    and everything else plus the file's content hash in meta.json.
+    """
+    arrayNames = ('vertices', 'triangles', 'rotKeys', 'transKeys', 'vertexExtras')
+    groupFields = ('flags', 'name', 'materialIndex', 'comment')
+    materialFields = MS3DMaterial.__slots__
+    jointFields = ('flags', 'name', 'parentName', 'rotation', 'position', 'comment', 'color')
+    modelFields = ('animFps', 'currentTime', 'totalFrames', 'subVersion', 'modelComment', 'vertexExSubVersion',
+                   'jointExSubVersion', 'jointSize', 'transparencyMode', 'alphaRef', 'modelExSubVersion')
+
+    def __init__(self, directory=None, maxBytes=1 << 30):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'ms3d_cache')
+        self.maxBytes = maxBytes
+
+    def entryPath(self, filepath):
+        filepath = os.path.abspath(filepath)
+        stat = os.stat(filepath)
+        key = '{0}|{1}|{2}'.format(filepath, stat.st_size, stat.st_mtime_ns)
+        return os.path.join(self.directory, hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest())
+
+    def load(self, filepath):
+        """Returns the cached MS3DModel of a file, or None on a miss"""
+        entry = self.entryPath(filepath)
+        try:
+            with open(os.path.join(entry, 'meta.json'), 'r') as file:
+                meta = json.load(file)
+            arrays = {name: np.load(os.path.join(entry, name + '.npy'), mmap_mode='r') for name in self.arrayNames}
+        except (OSError, ValueError):
+            return None
+        #refresh the entry's position in the lru order
+        os.utime(entry)
+        model = MS3DModel()
+        for name in self.arrayNames:
+            setattr(model, name, arrays[name])
+        for name in self.modelFields:
+            setattr(model, name, meta[name])
+        model.groups = [MS3DGroup(**group) for group in meta['groups']]
+        model.materials = [MS3DMaterial(**material) for material in meta['materials']]
+        rotStart = 0
+        transStart = 0
+        for joint, (rotCount, transCount) in zip(meta['joints'], meta['keyCounts']):
+            model.joints.append(MS3DJoint(
+                rotKeys=model.rotKeys[rotStart:rotStart + rotCount],
+                transKeys=model.transKeys[transStart:transStart + transCount],
+                **joint))
+            rotStart += rotCount
+            transStart += transCount
+        return model
+
+    def contentHash(self, filepath):
+        """Content hash recorded for a cached file, or None on a miss"""
+        try:
+            with open(os.path.join(self.entryPath(filepath), 'meta.json'), 'r') as file:
+                return json.load(file)['contentHash']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def store(self, filepath, model):
+        entry = self.entryPath(filepath)
+        meta = {name: getattr(model, name) for name in self.modelFields}
+        meta['contentHash'] = fileHash(filepath)
+        meta['groups'] = [{name: getattr(group, name) for name in self.groupFields} for group in model.groups]
+        meta['materials'] = [{name: getattr(material, name) for name in self.materialFields} for material in model.materials]
+        meta['joints'] = [{name: getattr(joint, name) for name in self.jointFields} for joint in model.joints]
+        meta['keyCounts'] = [(len(joint.rotKeys), len(joint.transKeys)) for joint in model.joints]
+        #write next to the entry and rename, so readers never see a partial entry
+        os.makedirs(self.directory, exist_ok=True)
+        partial = tempfile.mkdtemp(dir=self.directory, prefix='.partial')
+        try:
+            for name in self.arrayNames:
+                np.save(os.path.join(partial, name + '.npy'), np.ascontiguousarray(getattr(model, name)))
+            with open(os.path.join(partial, 'meta.json'), 'w') as file:
+                json.dump(meta, file)
+            os.replace(partial, entry)
+        except OSError:
+            shutil.rmtree(partial, ignore_errors=True)
+            if not os.path.isdir(entry):
+                raise
+        self.evict()
+
+    def entries(self):
+        """(last use, size in bytes, path) of every entry"""
+        result = []
+        try:
+            dirEntries = list(os.scandir(self.directory))
+        except OSError:
+            return result
+        for dirEntry in dirEntries:
+            if not dirEntry.is_dir() or dirEntry.name.startswith('.'):
+                continue
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(dirEntry.path))
+                result.append((dirEntry.stat().st_mtime, size, dirEntry.path))
+            except OSError:
+                pass
+        return result
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in maxBytes"""
+        entries = sorted(self.entries())
+        total = sum(size for lastUse, size, path in entries)
+        for lastUse, size, path in entries:
+            if total <= self.maxBytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+def cached_load_ms3d(filepath, cache):
+    """load_ms3d that goes through an MS3DCache, skipping the parse entirely on a hit"""
+    model = cache.load(filepath)
+    if model is None:
+        model = load_ms3d(filepath)
+        try:
+            cache.store(filepath, model)
+        except OSError as e:
+            print('Warning: could not cache ' + filepath + ': ' + str(e))
+    return model
+
+def timed_load_ms3d(filepath, cache=None):
+    """load_ms3d that also returns the parse time in seconds, used by batch import workers"""
+    start = time.perf_counter()
+    if cache is not None:
+        model = cached_load_ms3d(filepath, cache)
+    else:
+        model = load_ms3d(filepath)
+    return model, time.perf_counter() - start
@@ -3,448 +3,768 @@ bl_info = {
     "author": "Minon",
     "version": (1, 0, 1),
     "blender": (2, 80, 0),
-    "location": "File > Import",
-    "description": "Import Milkshape3D (.ms3d) files",
+    "location": "File > Import-Export",
+    "description": "Import and export Milkshape3D (.ms3d) files",
     "warning": "",
     "wcooliki_url": "",
     "tracker_url": "",
-    "category": "Import"}
+    "category": "Import-Export"}
 
 import bpy
+import contextlib
+import cProfile
+import hashlib
+import json
 import mathutils
-import struct
-import math
-from pathlib import Path
+import multiprocessing
+import os
+import threading
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
-from bpy_extras.io_utils import ImportHelper
-from bpy.props import StringProperty, BoolProperty, EnumProperty
-from bpy.types import Operator
+from bpy_extras.io_utils import ExportHelper, ImportHelper
+from bpy.props import StringProperty, BoolProperty, EnumProperty, IntProperty, CollectionProperty
+from bpy.types import Operator, OperatorFileListElement
 
-"""Importer script for Milkshape3D ms3d files
+#ms3d_format.py holds the Blender-independent parser and must be installed next to this file
+try:
+    from .ms3d_format import (MS3DCache, MS3DError, flipYZ, load_ms3d, cached_load_ms3d,
+        timed_load_ms3d, parseClips, parseMaterialInputs, vertexWeights, fileHash, MS3DGroup, MS3DJoint,
+        MS3DMaterial, MS3DModel, formatClips, formatMaterialInputs, keyframeDtype, triangleDtype, unflipYZ,
+        vertexDtype, vertexExDtypes, write_ms3d)
+except ImportError:
+    from ms3d_format import (MS3DCache, MS3DError, flipYZ, load_ms3d, cached_load_ms3d,
+        timed_load_ms3d, parseClips, parseMaterialInputs, vertexWeights, fileHash, MS3DGroup, MS3DJoint,
+        MS3DMaterial, MS3DModel, formatClips, formatMaterialInputs, keyframeDtype, triangleDtype, unflipYZ,
+        vertexDtype, vertexExDtypes, write_ms3d)
+
+"""Importer and exporter script for Milkshape3D ms3d files
 
 Author:
     Minon - Mar.9.2023
 """
-class MS3D_Import(Operator, ImportHelper):
-    """Imports a Milkshape3D file as a single object"""
+#(absolute path, mtime, size, colorspace) -> image name, shared by materials, comment inputs and repeated imports
+imageCache = {}
 
-    @staticmethod
-    def readInt16(file):
-        return int.from_bytes(file.read(2), 'little')
+def loadImage(path, colorspace=None, stat=None):
+    """Loads an image once per file version, reusing the datablock while the file is unchanged"""
+    path = os.path.abspath(path)
+    if stat is None:
+        stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size, colorspace)
+    name = imageCache.get(key)
+    if name is not None:
+        image = bpy.data.images.get(name)
+        #the datablock may have been removed or renamed since it was cached
+        if image is not None and os.path.abspath(bpy.path.abspath(image.filepath)) == path:
+            return image
+    #older versions of the same file aren't reused anymore
+    for oldKey in [k for k in imageCache if k[0] == path and k[3] == colorspace]:
+        del imageCache[oldKey]
+    image = bpy.data.images.load(path)
+    if colorspace is not None:
+        image.colorspace_settings.name = colorspace
+    imageCache[key] = image.name
+    return image
+
+def materialTemplate():
+    """Hidden material holding the node setup that imported materials are copied from"""
+    template = bpy.data.materials.get('.ms3dTemplate')
+    if template is None:
+        template = bpy.data.materials.new('.ms3dTemplate')
+        template.use_nodes = True
+        nodes = template.node_tree.nodes
+        bsdfNode = nodes.new('ShaderNodeEeveeSpecular')
+        nodes.remove(nodes['Principled BSDF'])
+        template.node_tree.links.new(bsdfNode.outputs['BSDF'], nodes['Material Output'].inputs['Surface'])
+    return template
+
+def materialKey(ms3dMaterial, textures):
+    """Hash of everything that ends up in an imported material, so identical ms3d materials can share one"""
+    def textureKey(path):
+        texture = textures.get(path)
+        return (texture[0], texture[1].st_mtime_ns, texture[1].st_size) if texture else path
+    key = (
+        tuple(map(float, ms3dMaterial.ambient)),
+        tuple(map(float, ms3dMaterial.diffuse)),
+        tuple(map(float, ms3dMaterial.specular)),
+        tuple(map(float, ms3dMaterial.emissive)),
+        float(ms3dMaterial.shininess),
+        float(ms3dMaterial.transparency),
+        int(ms3dMaterial.mode),
+        textureKey(ms3dMaterial.texture),
+        tuple((name, textureKey(path)) for name, path in parseMaterialInputs(ms3dMaterial.comment)),
+    )
+    return hashlib.blake2b(repr(key).encode('utf-8'), digest_size=16).hexdigest()
+
+def setNodeInput(node, name, value):
+    #input names differ between blender versions
+    socket = node.inputs.get(name)
+    if socket is not None:
+        socket.default_value = value
+
+def buildMaterial(ms3dMaterial, textures, key):
+    """Creates a material from a copy of the template, tagged with its materialKey"""
+    material = materialTemplate().copy()
+    material.name = ms3dMaterial.name
+    material['ms3dHash'] = key
+    nodes = material.node_tree.nodes
+    links = material.node_tree.links
+    bsdfNode = nodes['Specular BSDF']
+    #ambient has no counterpart in the specular bsdf
+    setNodeInput(bsdfNode, 'Base Color', ms3dMaterial.diffuse)
+    setNodeInput(bsdfNode, 'Specular', ms3dMaterial.specular)
+    setNodeInput(bsdfNode, 'Emissive Color', ms3dMaterial.emissive)
+    #milkshape's specular power goes from 0 to 128
+    setNodeInput(bsdfNode, 'Roughness', 1.0 - min(max(ms3dMaterial.shininess, 0.0), 128.0) / 128.0)
+    setNodeInput(bsdfNode, 'Transparency', 1.0 - ms3dMaterial.transparency)
+    material.diffuse_color = ms3dMaterial.diffuse
+    strPath = ms3dMaterial.texture #diffuse texture filepath
+    if strPath != '':
+        texNode = nodes.new('ShaderNodeTexImage')
+        links.new(texNode.outputs['Color'], bsdfNode.inputs['Base Color'])
+        texture = textures[strPath]
+        if texture:
+            texNode.image = loadImage(texture[0], stat=texture[1])
+        else:
+            print('Warning: texture path not found at: ' + strPath)
+    #use material comment to adjust other values not supported by ms3d
+    #<inputName>=<texture filepath>
+    for strInputName, strPath in parseMaterialInputs(ms3dMaterial.comment):
+        i_input = bsdfNode.inputs.find(strInputName)
+        #check if the input exists
+        if i_input > -1:
+            texNode = nodes.new('ShaderNodeTexImage')
+            links.new(texNode.outputs['Color'], bsdfNode.inputs[i_input])
+            texture = textures.get(strPath)
+            if texture:
+                #normal and roughness maps use non-color colorspace
+                if strInputName == 'Normal' or strInputName == 'Roughness':
+                    texNode.image = loadImage(texture[0], 'Non-Color', texture[1])
+                else:
+                    texNode.image = loadImage(texture[0], stat=texture[1])
+            else:
+                print('Warning: texture path not found at: ' + strPath)
+    return material
+
+def statOrNone(path):
+    try:
+        return os.stat(path)
+    except (OSError, ValueError):
+        return None
+
+class TextureIndex:
+    """Case-insensitive filename index over the model's directory and extra search roots
     
-    @staticmethod
-    def readFloat(file):
-        return struct.unpack('f', file.read(4))[0]
+    Stored texture paths that don't exist as-is are looked up by filename, first in the
+    model's directory and then recursively in each search root. The index is built on the
+    first miss, and all stats run in a small thread pool since the files may be on a network share.
+    """
+    statWorkers = 8
     
-    @staticmethod
-    def readInt(file):
-        return int.from_bytes(file.read(4), 'little')
+    def __init__(self, modelDir, searchRoots=()):
+        self.modelDir = modelDir
+        self.searchRoots = [root for root in searchRoots if root]
+        self.files = None
     
-    @staticmethod
-    def readString(file, length):
-        bytes = file.read(length)
-        s = bytes.split(b'\0')[0].decode('ascii')
-        s.encode('utf-8', 'strict')
-        return s
+    def build(self):
+        self.files = {}
+        #earlier roots win, so insert in reverse
+        for root in reversed(self.searchRoots):
+            for dirpath, dirnames, filenames in os.walk(root):
+                for filename in filenames:
+                    self.files[filename.lower()] = os.path.join(dirpath, filename)
+        try:
+            with os.scandir(self.modelDir or '.') as entries:
+                for entry in entries:
+                    self.files[entry.name.lower()] = entry.path
+        except OSError:
+            pass
     
-    @staticmethod
-    def readVec2(file):
-        x = MS3D_Import.readFloat(file)
-        y = MS3D_Import.readFloat(file)
-        return mathutils.Vector((x, y))
+    def resolve(self, paths):
+        """Maps each stored texture path to (absolute path, stat), or None when it can't be found"""
+        unique = [path for path in dict.fromkeys(paths) if path]
+        with ThreadPoolExecutor(self.statWorkers) as pool:
+            stats = dict(zip(unique, pool.map(statOrNone, unique)))
+            resolved = {}
+            fallbacks = {}
+            for path in unique:
+                if stats[path] is not None:
+                    resolved[path] = (os.path.abspath(path), stats[path])
+                    continue
+                if self.files is None:
+                    self.build()
+                #the stored path is usually a windows path, so only its filename is looked up
+                filename = path.replace('\\', '/').rsplit('/', 1)[-1].lower()
+                fallbacks[path] = self.files.get(filename)
+            candidates = [candidate for candidate in fallbacks.values() if candidate]
+            candidateStats = dict(zip(candidates, pool.map(statOrNone, candidates)))
+        for path, candidate in fallbacks.items():
+            if candidate and candidateStats[candidate] is not None:
+                resolved[path] = (os.path.abspath(candidate), candidateStats[candidate])
+            else:
+                resolved[path] = None
+        return resolved
+
+#callables receiving (filepath, {phase: seconds}) after every import, e.g. to collect timings in batch jobs
+timingHooks = []
+
+class ImportTimer:
+    """Accumulates the seconds spent in each phase of an import"""
     
-    @staticmethod
-    def readVec3_raw(file):
-        x = MS3D_Import.readFloat(file)
-        y = MS3D_Import.readFloat(file)
-        z = MS3D_Import.readFloat(file)
-        return mathutils.Vector((x, y, z))
+    def __init__(self):
+        self.seconds = {}
+    
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+    
+    def total(self):
+        return sum(self.seconds.values())
+    
+    def report(self, filepath):
+        return {'file': filepath, 'seconds': dict(self.seconds), 'total': self.total()}
+
+#largest difference between keys still treated as equal by buildAnimation's constantChannels
+constantTolerance = 1e-6
+
+class CreatedData:
+    """The datablocks created inside tracked sections of work, so they can be removed again
+    
+    Only what appears while a section runs is recorded, never anything created between sections.
+    """
+    collectionNames = ('objects', 'meshes', 'armatures', 'actions', 'materials', 'images')
     
+    def __init__(self):
+        self.names = {name: {} for name in self.collectionNames} #datablock name by pointer
+    
+    @contextlib.contextmanager
+    def track(self):
+        existing = {name: {block.as_pointer() for block in getattr(bpy.data, name)} for name in self.collectionNames}
+        try:
+            yield
+        finally:
+            for name in self.collectionNames:
+                names = self.names[name]
+                for block in getattr(bpy.data, name):
+                    pointer = block.as_pointer()
+                    #names are refreshed too, for blocks renamed after their creation
+                    if pointer not in existing[name] or pointer in names:
+                        names[pointer] = block.name
+    
+    def rollback(self):
+        """Removes the recorded datablocks that still exist, returning how many were removed"""
+        removed = 0
+        for name in self.collectionNames:
+            blocks = getattr(bpy.data, name)
+            names = self.names[name]
+            #pointer and name must both match, as a freed pointer may be reused by another datablock
+            for block in [block for block in blocks if names.get(block.as_pointer()) == block.name]:
+                blocks.remove(block)
+                removed += 1
+        return removed
+
+@contextlib.contextmanager
+def editMode(obj, viewLayer):
+    """The single bracketed edit mode section of an import, without needing a UI context
+    
+    obj is made active in viewLayer for the duration and object mode is restored afterwards.
+    """
+    previous = viewLayer.objects.active
+    viewLayer.objects.active = obj
+    override = {'view_layer': viewLayer, 'active_object': obj, 'object': obj}
+    def modeSet(mode):
+        if hasattr(bpy.context, 'temp_override'):
+            with bpy.context.temp_override(**override):
+                bpy.ops.object.mode_set(mode=mode, toggle=False)
+        else:
+            bpy.ops.object.mode_set(override, mode=mode, toggle=False)
+    modeSet('EDIT')
+    try:
+        yield
+    finally:
+        modeSet('OBJECT')
+        viewLayer.objects.active = previous
+
+def linearInterpolation():
+    """Enum value of 'LINEAR' keyframe interpolation, as used by foreach_set"""
+    return bpy.types.Keyframe.bl_rna.properties['interpolation'].enum_items['LINEAR'].value
+
+class MS3D_Import(Operator, ImportHelper):
+    """Imports a Milkshape3D file as a single object"""
+
     @staticmethod
-    def readVec3_yz(file):
-        x = MS3D_Import.readFloat(file)
-        y = MS3D_Import.readFloat(file)
-        z = MS3D_Import.readFloat(file)
-        return mathutils.Vector((x, y, z))
+    def splitAnimations(obj, baseAnim, clips, splitMode):
+        """Exposes (name, startFrame, endFrame) clips of baseAnim as actions, NLA strips or pose markers"""
+        if splitMode == 'NLA':
+            if obj.animation_data is None:
+                obj.animation_data_create()
+            track = obj.animation_data.nla_tracks.new()
+            track.name = 'ms3dClips'
+            for name, startFrame, endFrame in sorted(clips, key=lambda clip: clip[1]):
+                try:
+                    strip = track.strips.new(name, startFrame, baseAnim)
+                except RuntimeError:
+                    #strips can't overlap within a track, so overlapping clips get a track of their own
+                    track = obj.animation_data.nla_tracks.new()
+                    track.name = 'ms3dClips'
+                    strip = track.strips.new(name, startFrame, baseAnim)
+                strip.action_frame_start = startFrame
+                strip.action_frame_end = endFrame
+            return
+        if splitMode == 'MARKERS':
+            for name, startFrame, endFrame in clips:
+                baseAnim.pose_markers.new(name).frame = startFrame
+                baseAnim.pose_markers.new(name + '_end').frame = endFrame
+            return
+        #copy each clip into its own action, reading every base fcurve only once
+        #keys are sorted by frame, so a clip is the contiguous slice found by binary search
+        baseCurves = []
+        for baseF in baseAnim.fcurves:
+            co = np.empty(len(baseF.keyframe_points) * 2, np.float32)
+            baseF.keyframe_points.foreach_get('co', co)
+            co = co.reshape(-1, 2)
+            baseCurves.append((baseF, co))
+        for name, startFrame, endFrame in clips:
+            anim = bpy.data.actions.new(name)
+            for baseF, co in baseCurves:
+                f = anim.fcurves.new(baseF.data_path, index=baseF.array_index, action_group=baseF.group.name)
+                if len(co) == 1:
+                    #collapsed constant channel, holds its value in every clip
+                    MS3D_Import.fillFCurve(f, (0.0,), co[:, 1])
+                    continue
+                start = np.searchsorted(co[:, 0], startFrame, 'left')
+                end = np.searchsorted(co[:, 0], endFrame, 'right')
+                MS3D_Import.fillFCurve(f, co[start:end, 0] - startFrame, co[start:end, 1])
     
     @staticmethod
-    def readVec3_zy(file):
-        x = MS3D_Import.readFloat(file)
-        y = MS3D_Import.readFloat(file)
-        z = MS3D_Import.readFloat(file)
-        return mathutils.Vector((x, -z, y))
+    def fillFCurve(fcurve, frames, values):
+        """Fills an empty fcurve with linear keys in one bulk copy"""
+        count = len(frames)
+        co = np.empty((count, 2), np.float32)
+        co[:, 0] = frames
+        co[:, 1] = values
+        fcurve.keyframe_points.add(count)
+        fcurve.keyframe_points.foreach_set('co', co.ravel())
+        fcurve.keyframe_points.foreach_set('interpolation', np.full(count, linearInterpolation(), np.int32))
+        fcurve.update()
     
     @staticmethod
-    def readRotation_yz(file):
-        x = MS3D_Import.readFloat(file)
-        y = MS3D_Import.readFloat(file)
-        z = MS3D_Import.readFloat(file)
-        return mathutils.Euler((x, y, z), 'XYZ')
+    def buildMesh(name, vertPos, triIndexes, triU, triV, faceMaterialIndex):
+        """Creates a triangle mesh through bulk foreach_set copies"""
+        mesh = bpy.data.meshes.new(name)
+        triCount = len(triIndexes)
+        mesh.vertices.add(len(vertPos))
+        mesh.vertices.foreach_set('co', np.ascontiguousarray(vertPos, np.float32).ravel())
+        mesh.loops.add(triCount * 3)
+        mesh.loops.foreach_set('vertex_index', np.ascontiguousarray(triIndexes, np.int32).ravel())
+        mesh.polygons.add(triCount)
+        mesh.polygons.foreach_set('loop_start', np.arange(0, triCount * 3, 3, dtype=np.int32))
+        if bpy.app.version < (4, 0, 0):
+            mesh.polygons.foreach_set('loop_total', np.full(triCount, 3, np.int32))
+        mesh.polygons.foreach_set('material_index', np.ascontiguousarray(faceMaterialIndex, np.int32))
+        #per loop (u, 1 - v), flipping v since ms3d's origin is at the top
+        uvs = np.empty((triCount, 3, 2), np.float32)
+        uvs[..., 0] = triU
+        uvs[..., 1] = 1.0 - triV
+        uvLayer = mesh.uv_layers.new()
+        uvLayer.data.foreach_set('uv', uvs.ravel())
+        mesh.uv_layers.active = uvLayer
+        mesh.update(calc_edges=True)
+        return mesh
     
     @staticmethod
-    def readRotation_zy(file):
-        x = MS3D_Import.readFloat(file)
-        y = MS3D_Import.readFloat(file)
-        z = MS3D_Import.readFloat(file)
-        return mathutils.Euler((x, -z, y), 'XZY')
-
+    def buildNormals(mesh, triNormals, smoothGroups):
+        """Applies per corner normals as custom split normals, with sharp edges between smoothing groups
+        
+        Smoothing group 0 faces are flat, every edge they touch is sharp.
+        """
+        triCount = len(smoothGroups)
+        smoothGroups = np.asarray(smoothGroups, np.int32)
+        mesh.polygons.foreach_set('use_smooth', smoothGroups != 0)
+        #an edge is sharp when the faces around it don't all share one non zero smoothing group
+        loopEdges = np.empty(triCount * 3, np.int32)
+        mesh.loops.foreach_get('edge_index', loopEdges)
+        loopGroups = np.repeat(smoothGroups, 3)
+        edgeCount = len(mesh.edges)
+        minGroup = np.full(edgeCount, 256, np.int32)
+        maxGroup = np.full(edgeCount, -1, np.int32)
+        np.minimum.at(minGroup, loopEdges, loopGroups)
+        np.maximum.at(maxGroup, loopEdges, loopGroups)
+        mesh.edges.foreach_set('use_edge_sharp', (minGroup != maxGroup) | (minGroup == 0))
+        if bpy.app.version < (4, 1, 0):
+            mesh.use_auto_smooth = True
+        #custom normals are stored relative to the smooth fans, so they go in last
+        mesh.normals_split_custom_set(np.ascontiguousarray(triNormals, np.float32).reshape(-1, 3))
+    
     @staticmethod
-    def splitAnimation(baseAnim, name, startFrame, endFrame):
-        anim = bpy.data.actions.new(name)
-        for baseF in baseAnim.fcurves:
-            f = anim.fcurves.new(baseF.data_path, index=baseF.array_index, action_group=baseF.group.name)
-            for baseKf in baseF.keyframe_points:
-                if baseKf.co.x < startFrame:
-                    continue
-                if baseKf.co.x > endFrame:
-                    break
-                f.keyframe_points.insert(baseKf.co.x - startFrame, baseKf.co.y).interpolation = 'LINEAR'
+    def buildVertexGroups(meshObj, jointNames, vertexIndexes, boneIds, weights):
+        """Adds a vertex group per referenced joint, assigning its vertices in one call per distinct weight
+        
+        Influences are (vertexIndexes, boneIds, weights) arrays as returned by vertexWeights.
+        """
+        #sort by joint, then weight, so every add() is one contiguous run
+        order = np.lexsort((weights, boneIds))
+        boneIds = boneIds[order]
+        weights = weights[order]
+        vertexIndexes = vertexIndexes[order]
+        runStarts = np.flatnonzero(np.diff(boneIds, prepend=-2) | np.diff(weights, prepend=-1.0).astype(bool))
+        runEnds = np.append(runStarts[1:], len(order))
+        vertGroups = {}
+        for start, end in zip(runStarts.tolist(), runEnds.tolist()):
+            boneId = int(boneIds[start])
+            if boneId >= len(jointNames):
+                continue
+            group = vertGroups.get(boneId)
+            if group is None:
+                group = meshObj.vertex_groups.new(name=jointNames[boneId])
+                vertGroups[boneId] = group
+            group.add(vertexIndexes[start:end].tolist(), float(weights[start]), 'REPLACE')
+        return vertGroups
     
-    def read_ms3d(self, context, filepath, doFlipYZ, doSplitAnim):
+    def read_ms3d(self, context, filepath, doFlipYZ, doSplitAnim, splitMode='ACTIONS', textureSearchPaths='', cache=None, timer=None,
+                  constantChannels='KEEP', instancing=False):
         print("Attempting to open " + filepath)
-        f = open(filepath, 'rb')
-        lastIndex = filepath.rfind('\\')
-        dirpath = filepath[0:lastIndex+1]
-        print('directory path: ' + dirpath)
-        
-        #shortens method calls
-        readInt = self.readInt
-        readInt16 = self.readInt16
-        readFloat = self.readFloat
-        readString = self.readString
-        readVec2 = self.readVec2
-        readVec3_raw = self.readVec3_raw
-        if doFlipYZ:
-            readVec3 = self.readVec3_zy
-            readRotation = self.readRotation_zy
-        else:
-            readVec3 = self.readVec3_yz
-            readRotation = self.readRotation_yz
-        
-        #read header
-        data = f.read(10)
-        header = str(data, 'UTF-8')
-        if header != 'MS3D000000':
-            print('error: invalid header')
-            return {'CANCELLED'}
-        
-        #read file version
-        fileVersion = readInt(f)
-        if fileVersion != 4:
-            print('error: invalid file version: ' + str(fileVersion))
+        if timer is None:
+            timer = ImportTimer()
+        contentHash = None
+        if instancing:
+            try:
+                contentHash = importHash(filepath, cache)
+            except OSError as e:
+                print('error: ' + str(e))
+                return {'CANCELLED'}
+            instance = instance_ms3d(filepath, context.scene.collection, contentHash=contentHash)
+            if instance is not None:
+                selectImported(context, *instance)
+                return {'FINISHED'}
+        try:
+            with timer.phase('parse'):
+                if cache is not None:
+                    model = cached_load_ms3d(filepath, cache)
+                else:
+                    model = load_ms3d(filepath)
+        except (MS3DError, OSError) as e:
+            print('error: ' + str(e))
             return {'CANCELLED'}
+        return self.build_ms3d(context, model, filepath, doFlipYZ=doFlipYZ, doSplitAnim=doSplitAnim, splitMode=splitMode,
+            textureSearchPaths=textureSearchPaths, timer=timer, constantChannels=constantChannels, contentHash=contentHash)
+    
+    @classmethod
+    def buildMaterials(cls, model, filepath, textureSearchPaths=''):
+        """Returns the model's unique blender materials and the mesh slot of each ms3d material"""
+        #resolve every texture reference up front
+        texRefs = []
+        for ms3dMaterial in model.materials:
+            texRefs.append(ms3dMaterial.texture)
+            texRefs.extend(path for inputName, path in parseMaterialInputs(ms3dMaterial.comment))
+        textureIndex = TextureIndex(os.path.dirname(filepath), textureSearchPaths.split(';'))
+        textures = textureIndex.resolve(texRefs)
         
-        #read vertices
-        vertCount = self.readInt16(f)
-        print('vertex count: ' + str(vertCount))
-        
-        vertPos = []
-        vertBIndexes = []
-        vertBWeights = []
-        
-        for i in range(vertCount):
-            f.read(1) #flags
-            vertPos.append(readVec3(f)) #pos
-            vertBIndexes.append((int.from_bytes(f.read(1), 'little'), 0, 0, 0)) #bone index
-            vertBWeights.append((1.0, 0.0, 0.0, 0.0))
-            f.read(1) #ref count
-            
-        #read triangles
-        triCount = self.readInt16(f)
-        print('triangle count: ' + str(triCount))
-        
-        triIndexes = []
-        triNorms = []
-        triUVs = []
-        triSmoothGroup = []
-        triGroupIndex = []
-        
-        for i in range(triCount):
-            f.read(2) #flags
-            triIndexes.append((readInt16(f), readInt16(f), readInt16(f))) #indexes
-            triNorms.append((readVec3(f), readVec3(f), readVec3(f))) #normals
-            triUVs.append((readVec3_raw(f), readVec3_raw(f))) #uvs, for whatever reason stored in order u0, u1, u2, v0, v1, v2
-            triSmoothGroup.append(f.read(1)) #smooth group
-            triGroupIndex.append(int.from_bytes(f.read(1), 'little')) #group index
-        
-        #read groups
-        groupCount = self.readInt16(f)
-        groupMaterialIndex = []
-        
-        for i in range(groupCount):
-            f.read(1) #flags
-            readString(f, 32) #group name
-            gTriCount = readInt16(f) #triangles in group
-            for j in range(gTriCount):
-                readInt16(f) #triangle indexes
-            groupMaterialIndex.append(int.from_bytes(f.read(1), 'little')) #material index
-            
-        #read materials
-        matCount = readInt16(f)
+        #identical ms3d materials share one blender material (and mesh slot), also across imports
+        existingMaterials = {material.get('ms3dHash'): material for material in bpy.data.materials if material.get('ms3dHash')}
         materials = []
+        materialSlots = []
+        slotsByKey = {}
         
-        for i in range(matCount):
-            name = readString(f, 32) #material name
-            material = bpy.data.materials.new(name)
-            materials.append(material)
-            material.use_nodes = True
-            bsdfNode = material.node_tree.nodes.new('ShaderNodeEeveeSpecular')
-            material.node_tree.nodes.remove(material.node_tree.nodes['Principled BSDF'])
-            material.node_tree.links.new(bsdfNode.outputs['BSDF'], material.node_tree.nodes['Material Output'].inputs['Surface'])
-            readFloat(f) #ambient r
-            readFloat(f) #ambient g
-            readFloat(f) #ambient b
-            readFloat(f) #ambient a
-            readFloat(f) #diffuse r
-            readFloat(f) #diffuse g
-            readFloat(f) #diffuse b
-            readFloat(f) #diffuse a
-            readFloat(f) #specular r
-            readFloat(f) #specular g
-            readFloat(f) #specular b
-            readFloat(f) #specular a
-            readFloat(f) #emissive r
-            readFloat(f) #emissive g
-            readFloat(f) #emissive b
-            readFloat(f) #emissive a
-            readFloat(f) #specular power
-            readFloat(f) #alpha
-            f.read(1) #mode (spheremapping and such, I think)
-            strPath = readString(f, 128) #diffuse texture filepath
-            if strPath != '':
-                texNode = material.node_tree.nodes.new('ShaderNodeTexImage')
-                material.node_tree.links.new(texNode.outputs['Color'], bsdfNode.inputs['Base Color'])
-                texPath = Path(strPath)
-                #if the texture file doesn't exist as-is, attempt to find it in the ms3d file's directory
-                if not texPath.exists():
-                    strPath = str(texPath)
-                    lastIndex = strPath.rfind('\\')
-                    texPath = Path(dirpath + strPath[lastIndex+1:])
-                if texPath.exists():
-                    texNode.image = bpy.data.images.load(str(texPath.absolute()))
-                else:
-                    print('Warning: texture path not found at: ' + str(texPath.absolute()))
-            readString(f, 128) #alphablend(probably) texture filepath
-            
-        #read animation config
-        animFps = readFloat(f)
-        readFloat(f) #current time on timeline
-        maxFrames = readInt(f)
+        for ms3dMaterial in model.materials:
+            key = materialKey(ms3dMaterial, textures)
+            if key not in slotsByKey:
+                material = existingMaterials.get(key)
+                if material is None:
+                    material = buildMaterial(ms3dMaterial, textures, key)
+                    existingMaterials[key] = material
+                slotsByKey[key] = len(materials)
+                materials.append(material)
+            materialSlots.append(slotsByKey[key])
+        return materials, materialSlots
+    
+    @classmethod
+    def buildArmature(cls, collection, viewLayer, model, doFlipYZ):
+        """Creates the armature object with a bone per joint, linked to collection
         
-        #read joints (skeleton)
-        jointCount = readInt16(f)
+        viewLayer must include collection, bones can only be created in its edit mode.
+        """
         armature = bpy.data.armatures.new("ms3dSkeleton")
         
         #create object
         obj = bpy.data.objects.new("ms3dObj", armature)
         
         #add object to scene
-        bpy.context.scene.collection.objects.link(obj)
+        collection.objects.link(obj)
         
-        bpy.context.view_layer.objects.active = obj
-        bpy.ops.object.mode_set(mode='EDIT', toggle=False)
-        editBones = armature.edit_bones
-        bonesByIndex = []
+        with editMode(obj, viewLayer):
+            cls.buildBones(armature.edit_bones, model, doFlipYZ)
+        
+        #set pose bones to use xyz rotations, the pose exists once edit mode is left
+        for b in obj.pose.bones:
+            if doFlipYZ:
+                b.rotation_mode = 'XZY'
+            else:
+                b.rotation_mode = 'XYZ'
+        return obj
+    
+    @staticmethod
+    def buildBones(editBones, model, doFlipYZ):
+        """Adds an edit bone per joint, placed by the joints' chained local transforms"""
         bones = {}
-        boneNames = {}
         boneTransforms = {}
         
-        defaultAnim = bpy.data.actions.new('default')
-        
-        #action -> actionGroup > channels > keyframe
-        #in my words: animation -> bone -> dimension > keyframe
-        #channels are linked to properties using data_path, e.g. 'pose.bones["rHand"].location'
-        #    and array_index, which marks the index into the vector of that property
-        #    so basically 0 for x, 1 for y, 2 for z
-        #actionGroups are actually optional but definitely sensible to have
-        
-        for i in range(jointCount):
-            f.read(1) #flags
-            name = readString(f, 32)
+        for joint in model.joints:
+            name = joint.name
             b = editBones.new(name)
             bones[name] = b
-            boneNames[b] = name
-            bonesByIndex.append(b)
-            parnName = readString(f, 32)
+            parnName = joint.parentName
             if parnName in bones.keys():
                 b.parent = bones[parnName]
-            rot = readRotation(f) #joint local rotation
-            pos = mathutils.Vector(readVec3(f)) #joint localposition
+            x, y, z = joint.rotation #joint local rotation
+            if doFlipYZ:
+                rot = mathutils.Euler((x, -z, y), 'XZY')
+            else:
+                rot = mathutils.Euler((x, y, z), 'XYZ')
+            x, y, z = joint.position #joint local position
+            if doFlipYZ:
+                pos = mathutils.Vector((x, -z, y))
+            else:
+                pos = mathutils.Vector((x, y, z))
             b.head = mathutils.Vector((0, 0, 0))
             b.tail = mathutils.Vector((0, 0, 1))
             posMat = mathutils.Matrix.Translation(pos)
             rotMat = rot.to_matrix().to_4x4()
-            p = b.parent
             transform = posMat @ rotMat
             if b.parent:
                 transform = boneTransforms[b.parent] @ transform
             b.matrix = transform
             boneTransforms[b] = transform
-            rotKfCount = readInt16(f) #number of rotation keyframes
-            transKfCount = readInt16(f) #number of translation keyframes
-            #create animation channels
-            actionGroup = defaultAnim.groups.new(name)
-            posX = defaultAnim.fcurves.new('pose.bones["' + name + '"].location', index=0, action_group=name)
-            posY = defaultAnim.fcurves.new('pose.bones["' + name + '"].location', index=1, action_group=name)
-            posZ = defaultAnim.fcurves.new('pose.bones["' + name + '"].location', index=2, action_group=name)
-            rotX = defaultAnim.fcurves.new('pose.bones["' + name + '"].rotation_euler', index=0, action_group=name)
-            rotY = defaultAnim.fcurves.new('pose.bones["' + name + '"].rotation_euler', index=1, action_group=name)
-            rotZ = defaultAnim.fcurves.new('pose.bones["' + name + '"].rotation_euler', index=2, action_group=name)
-            sclX = defaultAnim.fcurves.new('pose.bones["' + name + '"].scale', index=0, action_group=name)
-            sclY = defaultAnim.fcurves.new('pose.bones["' + name + '"].scale', index=1, action_group=name)
-            sclZ = defaultAnim.fcurves.new('pose.bones["' + name + '"].scale', index=2, action_group=name)
-            boneRotMat = rotMat 
-            boneRotMat.invert()
-            lastRot = mathutils.Vector((0, 0, 0))
-            for j in range(rotKfCount):
-                t = readFloat(f) * animFps #timePos
-                rot = readVec3(f) #rotation
-                while lastRot.x - rot.x > math.pi:
-                    rot.x += 2 * math.pi
-                while lastRot.y - rot.y > math.pi:
-                    rot.y += 2 * math.pi
-                while lastRot.z - rot.z > math.pi:
-                    rot.z += 2 * math.pi
-                rotX.keyframe_points.insert(t, rot.x).interpolation = 'LINEAR'
-                rotY.keyframe_points.insert(t, rot.y).interpolation = 'LINEAR'
-                rotZ.keyframe_points.insert(t, rot.z).interpolation = 'LINEAR'
-                lastRot = rot
-            for j in range(transKfCount):
-                t = readFloat(f) * animFps #timePos
-                pos = readVec3(f) #translation
-                posX.keyframe_points.insert(t, pos[0]).interpolation = 'LINEAR'
-                posY.keyframe_points.insert(t, pos[1]).interpolation = 'LINEAR'
-                posZ.keyframe_points.insert(t, pos[2]).interpolation = 'LINEAR'
-            sclX.keyframe_points.insert(0, 1).interpolation = 'LINEAR'
-            sclY.keyframe_points.insert(0, 1).interpolation = 'LINEAR'
-            sclZ.keyframe_points.insert(0, 1).interpolation = 'LINEAR'
-        
-        #set pose bones to use xyz rotations
-        bpy.ops.object.mode_set(mode='POSE', toggle=False)
-        for b in obj.pose.bones:
-            if doFlipYZ:
-                b.rotation_mode = 'XZY'
-            else:
-                b.rotation_mode = 'XYZ'
+    
+    @classmethod
+    def buildAnimation(cls, model, doFlipYZ, constantChannels='KEEP', boneNames=None):
+        """Creates the 'default' action holding every joint's keyframes
+        
+        Channels whose keys are all equal are kept as they are ('KEEP'), reduced to their
+        first key ('COLLAPSE'), or also dropped when they hold the rest pose ('DROP').
+        When boneNames is given, joints without a bone of the same name are skipped.
+        """
+        defaultAnim = bpy.data.actions.new('default')
+        cls.animateJoints(defaultAnim, model.joints, model.animFps, doFlipYZ, constantChannels, boneNames)
+        return defaultAnim
+    
+    @classmethod
+    def animateJoints(cls, action, joints, animFps, doFlipYZ, constantChannels='KEEP', boneNames=None):
+        """Adds the channels of joints to action, see buildAnimation"""
+        #action -> actionGroup > channels > keyframe
+        #in my words: animation -> bone -> dimension > keyframe
+        #channels are linked to properties using data_path, e.g. 'pose.bones["rHand"].location'
+        #    and array_index, which marks the index into the vector of that property
+        #    so basically 0 for x, 1 for y, 2 for z
+        #actionGroups are actually optional but definitely sensible to have
+        
+        for joint in joints:
+            name = joint.name
+            if boneNames is not None and name not in boneNames:
+                continue
+            rotKeys = joint.rotKeys
+            transKeys = joint.transKeys
+            #only joints with keys get channels, and no scale channels since ms3d has no scale keys
+            channels = []
+            if len(rotKeys):
+                rotValues = rotKeys['value']
+                if doFlipYZ:
+                    rotValues = flipYZ(rotValues)
+                #keep rotations continuous, correcting wrap-around in both directions
+                rotValues = np.unwrap(rotValues, axis=0)
+                channels.append(('rotation_euler', rotKeys['time'] * animFps, rotValues))
+            if len(transKeys):
+                transValues = transKeys['value']
+                if doFlipYZ:
+                    transValues = flipYZ(transValues)
+                channels.append(('location', transKeys['time'] * animFps, transValues))
             
-        bpy.ops.object.mode_set(mode='OBJECT', toggle=False)
-        
-        #read comments
-        subVersion = readInt(f)
-        if subVersion == 1:
-            #group comments
-            count = readInt(f)
-            for i in range(count):
-                i_group = readInt(f)
-                length = readInt(f)
-                comment = readString(f, length)
-                print('Group comment ' + str(i_group) + ':')
-                print(comment)
-            #material comments
-            count = readInt(f)
-            for i in range(count):
-                i_material = readInt(f)
-                length = readInt(f)
-                comment = readString(f, length)
-                material = materials[i_material]
-                print('Material comment ' + str(i_material) + ':')
-                print(comment)
-                #use material comment to adjust other values not supported by ms3d
-                for line in comment.splitlines():
-                    #<inputName> <texture filepath>
-                    i_space = line.find('=')
-                    if i_space > 0:
-                        strInputName = line[0:i_space]
-                        bsdfNode = material.node_tree.nodes['Specular BSDF']
-                        i_input = bsdfNode.inputs.find(strInputName)
-                        #check if the input exists
-                        if i_input > -1:
-                            texNode = material.node_tree.nodes.new('ShaderNodeTexImage')
-                            material.node_tree.links.new(texNode.outputs['Color'], bsdfNode.inputs[i_input])
-                            texPath = Path(line[i_space+1:])
-                            #if the texture file doesn't exist as-is, attempt to find it in the ms3d file's directory
-                            if not texPath.exists():
-                                strPath = str(texPath)
-                                lastIndex = strPath.rfind('\\')
-                                texPath = Path(dirpath + strPath[lastIndex+1:])
-                            if texPath.exists():
-                                texNode.image = bpy.data.images.load(str(texPath.absolute()))
-                                #normal and roughness maps use non-color colorspace
-                                if strInputName == 'Normal' or strInputName == 'Roughness':
-                                    texNode.image.colorspace_settings.name = 'Non-Color'
-                            else:
-                                print('Warning: texture path not found at: ' + str(texPath.absolute()))
-            #joint comments
-            count = readInt(f)
-            for i in range(count):
-                i_joint = readInt(f)
-                length = readInt(f)
-                comment = readString(f, length)
-                print('Joint comment ' + str(i_joint) + ':')
-                print(comment)
-            #model comment
-            count = readInt(f) #should be 1 at most
-            for i in range(count):
-                length = readInt(f)
-                comment = readString(f, length)
-                print('Model comment:')
-                print(comment)
-                #use model comment to split animations
-                for line in comment.splitlines():
-                    data = line.split()
-                    #anim <animationName> <startFrame> <endFrame>
-                    if data[0] == 'anim' and doSplitAnim and len(data) > 2:
-                        startFrame = int(data[2])
-                        #endFrame is optional, making it a single frame when omitted
-                        if len(data) > 3:
-                            endFrame = int(data[3])
-                        else:
-                            endFrame = startFrame
-                        self.splitAnimation(defaultAnim, data[1], startFrame, endFrame)
-        
-        #close file
-        f.close()
-        
-        #build the mesh
-        mesh = bpy.data.meshes.new('ms3dMesh')
-        mesh.use_auto_smooth = True
-        mesh.from_pydata(vertPos, [], triIndexes)
+            for prop, frames, values in channels:
+                for axis in range(3):
+                    axisFrames = frames
+                    axisValues = values[:, axis]
+                    if constantChannels != 'KEEP' and np.all(np.abs(axisValues - axisValues[0]) <= constantTolerance):
+                        #keys are relative to the rest pose, so a channel constant at 0 changes nothing
+                        if constantChannels == 'DROP' and abs(axisValues[0]) <= constantTolerance:
+                            continue
+                        axisFrames, axisValues = frames[:1], axisValues[:1]
+                    #create the channel, its action group is created along with the first one
+                    fcurve = action.fcurves.new('pose.bones["' + name + '"].' + prop, index=axis, action_group=name)
+                    cls.fillFCurve(fcurve, axisFrames, axisValues)
+    
+    @classmethod
+    def buildMeshObject(cls, collection, model, obj, materials, materialSlots, doFlipYZ):
+        """Creates the mesh object, parented to the armature object and linked to collection"""
+        vertPos = model.vertices['pos']
+        if doFlipYZ:
+            vertPos = flipYZ(vertPos)
+        
+        #per face material slot through the face's group
+        groupMaterialIndex = np.array([materialSlots[group.materialIndex] if 0 <= group.materialIndex < len(materialSlots) else 0
+            for group in model.groups] + [0], np.int32) #-1 when unassigned
+        #triangles referencing a missing group fall back to the trailing 0
+        faceMaterialIndex = groupMaterialIndex[np.minimum(model.triangles['groupIndex'], len(model.groups))]
+        
+        #uvs, for whatever reason stored in order u0, u1, u2, v0, v1, v2
+        mesh = cls.buildMesh('ms3dMesh', vertPos, model.triangles['indexes'], model.triangles['u'], model.triangles['v'], faceMaterialIndex)
+        triNormals = model.triangles['normals']
+        if doFlipYZ:
+            triNormals = flipYZ(triNormals)
+        cls.buildNormals(mesh, triNormals, model.triangles['smoothGroup'])
         for material in materials:
             mesh.materials.append(material)
-        uvLayer = mesh.uv_layers.new()
-        mesh.uv_layers.active = uvLayer
-        for i in range(len(mesh.polygons)):
-            face = mesh.polygons[i]
-            face.material_index = groupMaterialIndex[triGroupIndex[i]]
-            for j in range(len(face.vertices)):
-                uvLayer.data[face.loop_indices[j]].uv = mathutils.Vector((triUVs[i][0][j], 1.0 - triUVs[i][1][j]))
         
         meshObj = bpy.data.objects.new('ms3dMesh', mesh)
         meshObj.parent = obj
-        smoothing = meshObj.modifiers.new('smoothing', 'EDGE_SPLIT')
-        smoothing.use_edge_angle = False
-        
-        bpy.context.scene.collection.objects.link(meshObj)
-        meshObj.select_set(True)
-        bpy.ops.object.shade_smooth()
         
-        #rigging
-        #create vertexGroups
-        vertGroups = []
-        for b in bonesByIndex:
-            groupName = boneNames[b] #for some reason using b.name here causes utf8 errors
-            group = meshObj.vertex_groups.new(name=groupName)
-            vertGroups.append(group)
-        
-        #add indexes to vertexGroups
-        for i in range(len(vertBIndexes)):
-            vertGroups[vertBIndexes[i][0]].add([i], 1.0, 'ADD')
-            
-        #add the armature deform modifier
+        collection.objects.link(meshObj)
+        return meshObj
+    
+    @classmethod
+    def buildSkin(cls, model, meshObj):
+        """Adds a vertex group per joint that vertices are attached to, weighted from the vertex extras"""
+        jointNames = [joint.name for joint in model.joints] #for some reason using b.name here causes utf8 errors
+        cls.buildVertexGroups(meshObj, jointNames, *vertexWeights(model))
+    
+    @classmethod
+    def buildModifiers(cls, meshObj, obj):
+        """Adds the armature deform modifier"""
         deformer = meshObj.modifiers.new('armature', 'ARMATURE')
         deformer.object = obj
-
+    
+    @classmethod
+    def build_ms3d(cls, context, model, filepath, **options):
+        """Creates a parsed model in the context's scene, selecting the new objects
+        
+        options are passed on to build_objects.
+        """
+        obj, meshObj = cls.build_objects(model, filepath, context.scene.collection, context.view_layer, **options)
+        selectImported(context, obj, meshObj)
         return {'FINISHED'}
+    
+    @classmethod
+    def build_objects(cls, model, filepath, collection, viewLayer, **options):
+        """Creates the armature, mesh, materials and actions of a parsed model, returning the armature and mesh objects
+        
+        Objects are linked to collection, which viewLayer must include. Only the data API is
+        used apart from one edit mode section, so no UI context is needed.
+        options are passed on to buildSteps.
+        """
+        steps = cls.buildSteps(model, filepath, collection, viewLayer, **options)
+        while True:
+            try:
+                next(steps)
+            except StopIteration as done:
+                return done.value
+    
+    @classmethod
+    def buildSteps(cls, model, filepath, collection, viewLayer, doFlipYZ=True, doSplitAnim=True, splitMode='ACTIONS',
+                   textureSearchPaths='', timer=None, constantChannels='KEEP', contentHash=None, jointChunk=16):
+        """Generator doing the work of build_objects in bounded chunks, yielding the fraction done after each
+        
+        Animation channels are added jointChunk joints at a time. The generator returns the
+        (armature, mesh) objects. The armature object records filepath and, when given, its
+        contentHash (see importHash) for instance_ms3d.
+        Time spent in each phase is added to timer, an ImportTimer, and passed on to timingHooks.
+        """
+        if timer is None:
+            timer = ImportTimer()
+        print('directory path: ' + os.path.dirname(filepath))
+        print('vertex count: ' + str(len(model.vertices)))
+        print('triangle count: ' + str(len(model.triangles)))
+        jointChunks = [model.joints[i:i + jointChunk] for i in range(0, len(model.joints), jointChunk)]
+        stepCount = 6 + len(jointChunks)
+        
+        with timer.phase('materials'):
+            materials, materialSlots = cls.buildMaterials(model, filepath, textureSearchPaths)
+        yield 1 / stepCount
+        with timer.phase('bones'):
+            obj = cls.buildArmature(collection, viewLayer, model, doFlipYZ)
+        yield 2 / stepCount
+        with timer.phase('fcurves'):
+            defaultAnim = bpy.data.actions.new('default')
+        for i, joints in enumerate(jointChunks):
+            with timer.phase('fcurves'):
+                cls.animateJoints(defaultAnim, joints, model.animFps, doFlipYZ, constantChannels)
+            yield (3 + i) / stepCount
+        
+        #comments
+        for i, group in enumerate(model.groups):
+            if group.comment:
+                print('Group comment ' + str(i) + ':')
+                print(group.comment)
+        for i_material, ms3dMaterial in enumerate(model.materials):
+            if ms3dMaterial.comment:
+                print('Material comment ' + str(i_material) + ':')
+                print(ms3dMaterial.comment)
+        for i, joint in enumerate(model.joints):
+            if joint.comment:
+                print('Joint comment ' + str(i) + ':')
+                print(joint.comment)
+        if model.modelComment:
+            print('Model comment:')
+            print(model.modelComment)
+            #use model comment to split animations
+            #anim <animationName> <startFrame> <endFrame>
+            clips = parseClips(model.modelComment)
+            if doSplitAnim and clips:
+                with timer.phase('split'):
+                    cls.splitAnimations(obj, defaultAnim, clips, splitMode)
+        yield (3 + len(jointChunks)) / stepCount
+        
+        with timer.phase('mesh'):
+            meshObj = cls.buildMeshObject(collection, model, obj, materials, materialSlots, doFlipYZ)
+        yield (4 + len(jointChunks)) / stepCount
+        
+        #rigging
+        with timer.phase('skinning'):
+            cls.buildSkin(model, meshObj)
+        yield (5 + len(jointChunks)) / stepCount
+        with timer.phase('modifiers'):
+            cls.buildModifiers(meshObj, obj)
+        
+        #source of the objects, for later imports to instance them
+        obj['ms3dSource'] = os.path.abspath(filepath)
+        if contentHash:
+            obj['ms3dHash'] = contentHash
+        
+        print('import phases: ' + ', '.join('{0} {1:.3f}s'.format(name, seconds) for name, seconds in timer.seconds.items()))
+        for hook in timingHooks:
+            hook(filepath, dict(timer.seconds))
+        return obj, meshObj
+
+    @classmethod
+    def build_animation(cls, model, filepath, obj, doFlipYZ=True, doSplitAnim=True, splitMode='ACTIONS',
+                        timer=None, constantChannels='KEEP'):
+        """Writes a parsed model's keyframes and clips onto an existing armature object, returning its new action
+        
+        Joints are matched to obj's bones by name, the new action is assigned to obj.
+        """
+        if timer is None:
+            timer = ImportTimer()
+        boneNames = set(obj.data.bones.keys())
+        unmatched = [joint.name for joint in model.joints if joint.name not in boneNames]
+        if unmatched:
+            print('joints without a matching bone: ' + ', '.join(unmatched))
+        with timer.phase('fcurves'):
+            defaultAnim = cls.buildAnimation(model, doFlipYZ, constantChannels, boneNames)
+        if obj.animation_data is None:
+            obj.animation_data_create()
+        obj.animation_data.action = defaultAnim
+        clips = parseClips(model.modelComment)
+        if doSplitAnim and clips:
+            with timer.phase('split'):
+                cls.splitAnimations(obj, defaultAnim, clips, splitMode)
+        print('import phases: ' + ', '.join('{0} {1:.3f}s'.format(name, seconds) for name, seconds in timer.seconds.items()))
+        for hook in timingHooks:
+            hook(filepath, dict(timer.seconds))
+        return defaultAnim
 
     #=== Blender Importer Data
     bl_idname = "import_test.ms3d"  # important since its how bpy.ops.import_test.some_data is constructed
@@ -472,9 +792,754 @@ class MS3D_Import(Operator, ImportHelper):
         description="Split animations using model comments",
         default=True,
     )
+    
+    splitMode: EnumProperty(
+        name="Split As",
+        description="How animations split from model comments are exposed",
+        items=(
+            ('ACTIONS', "Actions", "Copy each animation's keys into an action of its own"),
+            ('NLA', "NLA Strips", "Add an NLA strip per animation playing its frame range of the default action"),
+            ('MARKERS', "Pose Markers", "Mark each animation's frame range on the default action, without copying keys"),
+        ),
+        default='ACTIONS',
+    )
+
+    constantChannels: EnumProperty(
+        name="Constant Channels",
+        description="What to do with animation channels whose keys all hold the same value",
+        items=(
+            ('KEEP', "Keep", "Keep every key"),
+            ('COLLAPSE', "Collapse", "Keep only the first key"),
+            ('DROP', "Drop", "Remove channels that hold the rest pose and collapse the others"),
+        ),
+        default='KEEP',
+    )
+
+    instancing: BoolProperty(
+        name="Instance Repeated Imports",
+        description="When this file (same path and contents) was already imported with this option, add objects sharing its mesh, armature and action instead of importing it again",
+        default=False,
+    )
+
+    animationOnly: BoolProperty(
+        name="Animation Only",
+        description="Only import keyframes and animation splits onto the active armature, matching joints to bones by name",
+        default=False,
+    )
+
+    textureSearchPaths: StringProperty(
+        name="Texture Search Paths",
+        description="Semicolon-separated directories searched recursively for textures that aren't found at their stored path or next to the model",
+        default="",
+    )
+    
+    batchImport: BoolProperty(
+        name="Batch Import",
+        description="Import every selected file, or every .ms3d file in the directory when none is selected, parsing them in parallel",
+        default=False,
+    )
+    
+    batchWorkers: IntProperty(
+        name="Worker Processes",
+        description="Processes used to parse files in a batch import, 0 uses one per CPU",
+        default=0,
+        min=0,
+    )
+    
+    useCache: BoolProperty(
+        name="Cache Decoded Data",
+        description="Keep decoded arrays on disk and load them instead of parsing files that haven't changed",
+        default=False,
+    )
+    
+    cacheSize: IntProperty(
+        name="Cache Size (MB)",
+        description="Least recently used entries are removed once the cache grows past this size",
+        default=1024,
+        min=1,
+    )
+    
+    backgroundImport: BoolProperty(
+        name="Import in Background",
+        description="Parse in a background thread, keeping the UI responsive, then build the model in small steps, allowing only view navigation. Esc cancels and removes everything created so far",
+        default=False,
+    )
+    
+    profileOutput: EnumProperty(
+        name="Profile Output",
+        description="Write timing data next to the imported file",
+        items=(
+            ('NONE', "None", "Don't write timing data"),
+            ('JSON', "Timing Report", "Write the seconds spent in each import phase to <file>.timing.json"),
+            ('PROFILE', "cProfile Dump", "Also write a cProfile dump of the whole import to <file>.prof"),
+        ),
+        default='NONE',
+    )
+    
+    files: CollectionProperty(type=OperatorFileListElement, options={'HIDDEN', 'SKIP_SAVE'})
+    directory: StringProperty(subtype='DIR_PATH', options={'HIDDEN', 'SKIP_SAVE'})
+
+    def execute(self, context):
+        if self.backgroundImport and not (self.batchImport or self.animationOnly) and context.window is not None:
+            return self.startModal(context)
+        profiler = cProfile.Profile() if self.profileOutput == 'PROFILE' else None
+        if profiler:
+            profiler.enable()
+        try:
+            result, reports = self.runImport(context)
+        finally:
+            if profiler:
+                profiler.disable()
+        self.writeReports(reports, profiler)
+        return result
+    
+    def writeReports(self, reports, profiler=None):
+        if self.profileOutput == 'NONE':
+            return
+        basePath = os.path.join(self.directory, 'ms3d_batch') if self.batchImport else self.filepath
+        with open(basePath + '.timing.json', 'w') as file:
+            json.dump(reports, file, indent=1)
+        if profiler:
+            profiler.dump_stats(basePath + '.prof')
+    
+    #seconds of building per timer event of a background import
+    modalBudget = 0.05
+    #events still passed on while building, anything else (undo, deleting) could leave the build steps with stale data
+    navigationEvents = {'MOUSEMOVE', 'INBETWEEN_MOUSEMOVE', 'MIDDLEMOUSE', 'WHEELUPMOUSE', 'WHEELDOWNMOUSE',
+                        'TRACKPADPAN', 'TRACKPADZOOM', 'NDOF_MOTION'}
+    
+    def startModal(self, context):
+        """Starts a background import: parsing in a thread, building in modalBudget steps on timer events
+        
+        Input is passed on while parsing. Once building starts only Esc and view navigation are.
+        """
+        cache = MS3DCache(maxBytes=self.cacheSize << 20) if self.useCache else None
+        self.contentHash = None
+        if self.instancing:
+            try:
+                self.contentHash = importHash(self.filepath, cache)
+            except OSError as e:
+                self.report({'ERROR'}, str(e))
+                return {'CANCELLED'}
+            instance = instance_ms3d(self.filepath, context.scene.collection, contentHash=self.contentHash)
+            if instance is not None:
+                selectImported(context, *instance)
+                return {'FINISHED'}
+        self.importTimer = ImportTimer()
+        self.steps = None
+        self.created = CreatedData()
+        #the thread only sees these locals and the holder, never the operator, which is freed when the import is cancelled
+        filepath = self.filepath
+        timer = self.importTimer
+        parsed = self.parsed = [] #(model, error) once parsing is done
+        def parse():
+            try:
+                with timer.phase('parse'):
+                    model = cached_load_ms3d(filepath, cache) if cache is not None else load_ms3d(filepath)
+                parsed.append((model, None))
+            except Exception as e:
+                #reported by modal, since nothing would report it on this thread
+                parsed.append((None, e))
+        #daemon, so a cancelled import doesn't keep blender from quitting
+        threading.Thread(target=parse, daemon=True).start()
+        wm = context.window_manager
+        self.eventTimer = wm.event_timer_add(0.02, window=context.window)
+        wm.progress_begin(0.0, 1.0)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+    
+    def modal(self, context, event):
+        if event.type == 'ESC' and event.value == 'PRESS':
+            self.cancel(context)
+            self.report({'INFO'}, 'Import cancelled')
+            return {'CANCELLED'}
+        if event.type != 'TIMER':
+            #input is only safe while the thread is still parsing, before any datablocks exist
+            if self.steps is None or event.type in self.navigationEvents:
+                return {'PASS_THROUGH'}
+            return {'RUNNING_MODAL'}
+        if self.steps is None:
+            if not self.parsed:
+                return {'RUNNING_MODAL'}
+            model, error = self.parsed[0]
+            if error is not None:
+                self.finishModal(context)
+                self.report({'ERROR'}, str(error) or type(error).__name__)
+                return {'CANCELLED'}
+            self.steps = self.buildSteps(model, self.filepath, context.scene.collection, context.view_layer,
+                doFlipYZ=self.doYZFlip, doSplitAnim=self.doSplitAnim, splitMode=self.splitMode,
+                textureSearchPaths=self.textureSearchPaths, timer=self.importTimer, constantChannels=self.constantChannels,
+                contentHash=self.contentHash)
+        deadline = time.perf_counter() + self.modalBudget
+        try:
+            with self.created.track():
+                while time.perf_counter() < deadline:
+                    context.window_manager.progress_update(next(self.steps))
+        except StopIteration as done:
+            self.finishModal(context)
+            selectImported(context, *done.value)
+            self.writeReports([self.importTimer.report(self.filepath)])
+            return {'FINISHED'}
+        except Exception:
+            self.cancel(context)
+            raise
+        return {'RUNNING_MODAL'}
+    
+    def cancel(self, context):
+        """Stops a background import, removing the datablocks it created"""
+        self.finishModal(context)
+        removed = self.created.rollback()
+        print('import of ' + self.filepath + ' cancelled, removed ' + str(removed) + ' datablock(s)')
+    
+    def finishModal(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self.eventTimer)
+        wm.progress_end()
+        if self.steps is not None:
+            self.steps.close()
+    
+    def runImport(self, context):
+        """Runs the single or batch import, returning its result and a timing report per file"""
+        if self.animationOnly:
+            obj = context.active_object
+            if obj is None or obj.type != 'ARMATURE':
+                self.report({'ERROR'}, 'Animation only import needs an active armature')
+                return {'CANCELLED'}, []
+            timer = ImportTimer()
+            try:
+                import_ms3d_animation(self.filepath, obj, doFlipYZ=self.doYZFlip, doSplitAnim=self.doSplitAnim,
+                    splitMode=self.splitMode, timer=timer, constantChannels=self.constantChannels)
+            except (MS3DError, OSError) as e:
+                self.report({'ERROR'}, str(e))
+                return {'CANCELLED'}, []
+            return {'FINISHED'}, [timer.report(self.filepath)]
+        cache = MS3DCache(maxBytes=self.cacheSize << 20) if self.useCache else None
+        if self.batchImport:
+            filepaths = [os.path.join(self.directory, f.name) for f in self.files if f.name]
+            if not filepaths:
+                filepaths = ms3dFilesIn(self.directory)
+            results = import_ms3d_batch(context, filepaths, self.batchWorkers, cache,
+                doFlipYZ=self.doYZFlip, doSplitAnim=self.doSplitAnim, splitMode=self.splitMode,
+                textureSearchPaths=self.textureSearchPaths, constantChannels=self.constantChannels,
+                instancing=self.instancing)
+            failures = [result for result in results if result.error]
+            self.report({'WARNING'} if failures else {'INFO'},
+                'Imported ' + str(len(results) - len(failures)) + ' of ' + str(len(results)) + ' file(s)')
+            reports = [{'file': result.filepath, 'seconds': result.phases, 'total': result.parseTime + result.buildTime,
+                'error': result.error} for result in results]
+            return ({'FINISHED'} if len(failures) < len(results) else {'CANCELLED'}), reports
+        timer = ImportTimer()
+        result = self.read_ms3d(context, self.filepath, self.doYZFlip, self.doSplitAnim, self.splitMode,
+            self.textureSearchPaths, cache, timer, self.constantChannels, self.instancing)
+        return result, [timer.report(self.filepath)]
+
+def selectImported(context, obj, meshObj):
+    """Selects the objects of an import, making the armature active"""
+    obj.select_set(True)
+    meshObj.select_set(True)
+    context.view_layer.objects.active = obj
+
+def findImported(filepath, contentHash):
+    """The armature object of an earlier import of the same file and contents, or None"""
+    filepath = os.path.abspath(filepath)
+    for obj in bpy.data.objects:
+        if obj.type == 'ARMATURE' and obj.get('ms3dSource') == filepath and obj.get('ms3dHash') == contentHash:
+            return obj
+    return None
+
+def importHash(filepath, cache=None):
+    """Content hash identifying a file for instancing, from cache when it has one"""
+    return (cache.contentHash(filepath) if cache is not None else None) or fileHash(filepath)
+
+def instance_ms3d(filepath, collection, cache=None, contentHash=None):
+    """Adds objects sharing the data of an earlier import of filepath to collection
+    
+    Returns the new (armature, mesh) objects, or None when the file with its current
+    contents wasn't imported before with instancing. contentHash is computed with
+    importHash when not given.
+    """
+    if contentHash is None:
+        contentHash = importHash(filepath, cache)
+    source = findImported(filepath, contentHash)
+    if source is None:
+        return None
+    meshSource = next((child for child in source.children if child.type == 'MESH'), None)
+    if meshSource is None:
+        return None
+    #object copies share their data: the armature, mesh (with its materials) and the action
+    obj = source.copy()
+    meshObj = meshSource.copy()
+    meshObj.parent = obj
+    for modifier in meshObj.modifiers:
+        if modifier.type == 'ARMATURE' and modifier.object == source:
+            modifier.object = obj
+    collection.objects.link(obj)
+    collection.objects.link(meshObj)
+    print('instanced ' + filepath + ' from ' + source.name)
+    return obj, meshObj
+
+def import_ms3d(filepath, scene=None, collection=None, viewLayer=None, cache=None, instancing=False, **options):
+    """Imports an ms3d file without operators or a UI context, for scripts and background jobs
+    
+    Objects are linked to collection, the scene's master collection by default, using
+    viewLayer (the scene's first by default) for the armature's edit mode section.
+    With instancing, an earlier import of the same file and contents is instanced instead.
+    Returns the (armature, mesh) objects and raises MS3DError or OSError when the file
+    can't be read. options are passed on to MS3D_Import.build_objects.
+    """
+    scene = scene or bpy.context.scene
+    collection = collection or scene.collection
+    viewLayer = viewLayer or scene.view_layers[0]
+    if instancing:
+        if options.get('contentHash') is None:
+            options['contentHash'] = importHash(filepath, cache)
+        instance = instance_ms3d(filepath, collection, contentHash=options['contentHash'])
+        if instance is not None:
+            return instance
+    timer = options.setdefault('timer', ImportTimer())
+    with timer.phase('parse'):
+        if cache is not None:
+            model = cached_load_ms3d(filepath, cache)
+        else:
+            model = load_ms3d(filepath)
+    return MS3D_Import.build_objects(model, filepath, collection, viewLayer, **options)
+
+def import_ms3d_animation(filepath, obj, **options):
+    """Imports only the animation of an ms3d file onto an existing armature object
+    
+    Vertex, triangle, group and material data is seeked over without decoding.
+    Returns the new action and raises MS3DError or OSError when the file can't be read.
+    options are passed on to MS3D_Import.build_animation.
+    """
+    timer = options.setdefault('timer', ImportTimer())
+    with timer.phase('parse'):
+        model = load_ms3d(filepath, animationOnly=True)
+    return MS3D_Import.build_animation(model, filepath, obj, **options)
+
+class MS3DBatchResult:
+    """Outcome and timings of one file of a batch import"""
+    __slots__ = ('filepath', 'parseTime', 'buildTime', 'phases', 'error')
+    
+    def __init__(self, filepath, parseTime=0.0, buildTime=0.0, phases=None, error=None):
+        self.filepath = filepath
+        self.parseTime = parseTime #seconds, measured in the worker
+        self.buildTime = buildTime #seconds spent creating the blender data
+        self.phases = phases if phases is not None else {} #seconds per import phase, parse included
+        self.error = error #message, None on success
+
+def ms3dFilesIn(directory):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.lower().endswith('.ms3d'))
+
+def import_ms3d_batch(context, filepaths, workers=0, cache=None, **options):
+    """Imports several ms3d files, returning an MS3DBatchResult per file
+    
+    Files are parsed concurrently into MS3DModels by a pool of worker processes, while the
+    blender data is built on the calling (main) thread as each model arrives.
+    Workers go through cache, an MS3DCache, when one is given. With instancing, files
+    imported before are instanced instead of being parsed again.
+    options are passed on to MS3D_Import.build_ms3d.
+    """
+    results = []
+    contentHashes = {}
+    if options.pop('instancing', False):
+        remaining = []
+        for filepath in filepaths:
+            start = time.perf_counter()
+            try:
+                contentHashes[filepath] = importHash(filepath, cache)
+                instance = instance_ms3d(filepath, context.scene.collection, contentHash=contentHashes[filepath])
+            except OSError:
+                instance = None #reported when the parse fails
+            if instance is None:
+                remaining.append(filepath)
+                continue
+            selectImported(context, *instance)
+            results.append(MS3DBatchResult(filepath, buildTime=time.perf_counter() - start))
+        filepaths = remaining
+    #spawn, since forking a running blender isn't safe
+    with ProcessPoolExecutor(workers or None, multiprocessing.get_context('spawn')) as pool:
+        futures = {pool.submit(timed_load_ms3d, filepath, cache): filepath for filepath in filepaths}
+        for future in as_completed(futures):
+            result = MS3DBatchResult(futures[future])
+            results.append(result)
+            try:
+                model, result.parseTime = future.result()
+            except Exception as e:
+                result.error = str(e) or type(e).__name__
+                print('error: ' + result.filepath + ': ' + result.error)
+                continue
+            start = time.perf_counter()
+            timer = ImportTimer()
+            timer.seconds['parse'] = result.parseTime
+            result.phases = timer.seconds
+            try:
+                if 'FINISHED' not in MS3D_Import.build_ms3d(context, model, result.filepath, timer=timer,
+                                                         contentHash=contentHashes.get(result.filepath), **options):
+                    result.error = 'import cancelled'
+            except Exception as e:
+                result.error = str(e) or type(e).__name__
+            result.buildTime = time.perf_counter() - start
+            print('{0}: parse {1:.3f}s, build {2:.3f}s{3}'.format(result.filepath, result.parseTime, result.buildTime,
+                ', error: ' + result.error if result.error else ''))
+    return results
+
+class MS3D_ClearImageCache(Operator):
+    """Drops cached ms3d texture entries whose images are gone or unused, removing the unused images"""
+    bl_idname = "import_test.ms3d_clear_image_cache"
+    bl_label = "Clear MS3D Image Cache"
+    
+    clearAll: BoolProperty(
+        name="Clear All",
+        description="Forget every cached entry, not only orphaned ones. Images still in use are kept",
+        default=False,
+    )
+    
+    def execute(self, context):
+        removed = 0
+        for key, name in list(imageCache.items()):
+            image = bpy.data.images.get(name)
+            if image is not None and image.users > 0:
+                if self.clearAll:
+                    del imageCache[key]
+                continue
+            if image is not None:
+                bpy.data.images.remove(image)
+            del imageCache[key]
+            removed += 1
+        self.report({'INFO'}, 'Removed ' + str(removed) + ' orphaned image(s)')
+        return {'FINISHED'}
+
+class MS3D_ClearArrayCache(Operator):
+    """Deletes the on-disk cache of decoded ms3d files"""
+    bl_idname = "import_test.ms3d_clear_array_cache"
+    bl_label = "Clear MS3D Decoded Data Cache"
+    
+    def execute(self, context):
+        MS3DCache().clear()
+        self.report({'INFO'}, 'Cleared ' + MS3DCache().directory)
+        return {'FINISHED'}
+
+def getNodeInput(node, name):
+    #input names differ between blender versions
+    socket = node.inputs.get(name)
+    if socket is not None and hasattr(socket, 'default_value'):
+        return socket.default_value
+    return None
 
+def colorValue(value, default):
+    """An rgba tuple of a color or float socket value"""
+    if value is None:
+        return tuple(default)
+    if isinstance(value, float):
+        return (value, value, value, 1.0)
+    return tuple(value)[:3] + (1.0,) if len(value) == 3 else tuple(value)
+
+def texturePath(image, directory):
+    """Path stored for an exported texture, relative to the model when it's next to or below it"""
+    path = bpy.path.abspath(image.filepath) if image.filepath else image.name
+    try:
+        relative = os.path.relpath(path, directory)
+    except ValueError:
+        #on another drive
+        return path
+    return path if relative.startswith('..') else relative
+
+def exportMaterial(material, directory):
+    """MS3DMaterial of a blender material, reading back the node setup buildMaterial creates"""
+    ms3dMaterial = MS3DMaterial(name=material.name, diffuse=tuple(material.diffuse_color))
+    if not material.use_nodes or material.node_tree is None:
+        return ms3dMaterial
+    bsdfNode = next((node for node in material.node_tree.nodes if node.type in ('EEVEE_SPECULAR', 'BSDF_PRINCIPLED')), None)
+    if bsdfNode is None:
+        return ms3dMaterial
+    ms3dMaterial.diffuse = colorValue(getNodeInput(bsdfNode, 'Base Color'), ms3dMaterial.diffuse)
+    ms3dMaterial.specular = colorValue(getNodeInput(bsdfNode, 'Specular'), ms3dMaterial.specular)
+    ms3dMaterial.emissive = colorValue(getNodeInput(bsdfNode, 'Emissive Color'), ms3dMaterial.emissive)
+    roughness = getNodeInput(bsdfNode, 'Roughness')
+    if roughness is not None:
+        ms3dMaterial.shininess = (1.0 - roughness) * 128.0
+    transparency = getNodeInput(bsdfNode, 'Transparency')
+    if transparency is not None:
+        ms3dMaterial.transparency = 1.0 - transparency
+    #image textures linked to the bsdf, base color as the diffuse texture, the others as comment inputs
+    inputs = []
+    for socket in bsdfNode.inputs:
+        if not socket.is_linked:
+            continue
+        texNode = socket.links[0].from_node
+        if texNode.type != 'TEX_IMAGE' or texNode.image is None:
+            continue
+        path = texturePath(texNode.image, directory)
+        if socket.name == 'Base Color' and not ms3dMaterial.texture:
+            ms3dMaterial.texture = path
+        else:
+            inputs.append((socket.name, path))
+    ms3dMaterial.comment = formatMaterialInputs(inputs)
+    return ms3dMaterial
+
+class MS3D_Export(Operator, ExportHelper):
+    """Exports the active armature, with its mesh, or the active mesh as a Milkshape3D file"""
+    
+    @staticmethod
+    def curveArray(fcurve):
+        """(frame, value) rows of an fcurve's keys, read in one bulk copy"""
+        co = np.empty(len(fcurve.keyframe_points) * 2, np.float32)
+        fcurve.keyframe_points.foreach_get('co', co)
+        return co.reshape(-1, 2)
+    
+    @classmethod
+    def exportKeys(cls, fcurves, fps, doFlipYZ):
+        """Keyframes of the x, y, z fcurves (None where missing) of a vector property"""
+        cos = [cls.curveArray(fcurve) if fcurve is not None else None for fcurve in fcurves]
+        keyed = [co[:, 0] for co in cos if co is not None and len(co)]
+        if not keyed:
+            return np.empty(0, keyframeDtype)
+        #ms3d keys hold all three axes, so every axis is sampled at every keyed frame
+        frames = np.unique(np.concatenate(keyed))
+        values = np.zeros((len(frames), 3), np.float32)
+        for axis, (fcurve, co) in enumerate(zip(fcurves, cos)):
+            if co is None or not len(co):
+                continue
+            if np.array_equal(co[:, 0], frames):
+                values[:, axis] = co[:, 1]
+            else:
+                values[:, axis] = [fcurve.evaluate(frame) for frame in frames.tolist()]
+        keys = np.empty(len(frames), keyframeDtype)
+        keys['time'] = frames / fps
+        keys['value'] = unflipYZ(values) if doFlipYZ else values
+        return keys
+    
+    @classmethod
+    def exportJoints(cls, model, armatureObj, action, fps, doFlipYZ):
+        """Adds a joint per bone, parents first, with its rest transform and keyframes"""
+        bones = [bone for bone in armatureObj.data.bones if bone.parent is None]
+        i = 0
+        while i < len(bones):
+            bones.extend(bones[i].children)
+            i += 1
+        if len(bones) > 127:
+            raise MS3DError('ms3d supports at most 127 joints, the armature has ' + str(len(bones)))
+        curves = {}
+        if action is not None:
+            for fcurve in action.fcurves:
+                curves[(fcurve.data_path, fcurve.array_index)] = fcurve
+        eulerOrder = 'XZY' if doFlipYZ else 'XYZ'
+        rotKeys = []
+        transKeys = []
+        for bone in bones:
+            name = bone.name
+            transform = bone.matrix_local
+            if bone.parent is not None:
+                transform = bone.parent.matrix_local.inverted() @ transform
+            rest = np.array([tuple(transform.to_euler(eulerOrder)), tuple(transform.to_translation())])
+            if doFlipYZ:
+                rest = unflipYZ(rest)
+            rotKeys.append(cls.exportKeys([curves.get(('pose.bones["' + name + '"].rotation_euler', axis)) for axis in range(3)],
+                fps, doFlipYZ))
+            transKeys.append(cls.exportKeys([curves.get(('pose.bones["' + name + '"].location', axis)) for axis in range(3)],
+                fps, doFlipYZ))
+            model.joints.append(MS3DJoint(name=name, parentName=bone.parent.name if bone.parent else '',
+                rotation=tuple(rest[0].tolist()), position=tuple(rest[1].tolist())))
+        #contiguous keys, with each joint's keys as views like read_model makes them
+        model.rotKeys = np.concatenate(rotKeys) if rotKeys else np.empty(0, keyframeDtype)
+        model.transKeys = np.concatenate(transKeys) if transKeys else np.empty(0, keyframeDtype)
+        rotStart = 0
+        transStart = 0
+        for joint, rot, trans in zip(model.joints, rotKeys, transKeys):
+            joint.rotKeys = model.rotKeys[rotStart:rotStart + len(rot)]
+            joint.transKeys = model.transKeys[transStart:transStart + len(trans)]
+            rotStart += len(rot)
+            transStart += len(trans)
+    
+    @staticmethod
+    def exportMesh(model, mesh, directory, doFlipYZ):
+        """Sets the model's vertices, triangles, a group per used material and their materials"""
+        mesh.calc_loop_triangles()
+        if bpy.app.version < (4, 1, 0):
+            mesh.calc_normals_split()
+        vertCount = len(mesh.vertices)
+        triCount = len(mesh.loop_triangles)
+        if vertCount > 65535 or triCount > 65535:
+            raise MS3DError('ms3d supports at most 65535 vertices and triangles, the mesh has '
+                + str(vertCount) + ' and ' + str(triCount))
+        vertPos = np.empty(vertCount * 3, np.float32)
+        mesh.vertices.foreach_get('co', vertPos)
+        vertPos = vertPos.reshape(-1, 3)
+        triVerts = np.empty(triCount * 3, np.int32)
+        mesh.loop_triangles.foreach_get('vertices', triVerts)
+        triLoops = np.empty(triCount * 3, np.int32)
+        mesh.loop_triangles.foreach_get('loops', triLoops)
+        triNormals = np.empty(triCount * 9, np.float32)
+        mesh.loop_triangles.foreach_get('split_normals', triNormals)
+        triNormals = triNormals.reshape(-1, 3, 3)
+        triPolygons = np.empty(triCount, np.int32)
+        mesh.loop_triangles.foreach_get('polygon_index', triPolygons)
+        triMaterials = np.empty(triCount, np.int32)
+        mesh.loop_triangles.foreach_get('material_index', triMaterials)
+        polySmooth = np.empty(len(mesh.polygons), bool)
+        mesh.polygons.foreach_get('use_smooth', polySmooth)
+        if doFlipYZ:
+            vertPos = unflipYZ(vertPos)
+            triNormals = unflipYZ(triNormals)
+        
+        model.vertices = np.zeros(vertCount, vertexDtype)
+        model.vertices['pos'] = vertPos
+        model.vertices['boneId'] = -1
+        model.vertices['refCount'] = np.minimum(np.bincount(triVerts, minlength=vertCount), 255)
+        
+        triangles = np.zeros(triCount, triangleDtype)
+        triangles['indexes'] = triVerts.reshape(-1, 3)
+        triangles['normals'] = triNormals
+        uvLayer = mesh.uv_layers.active
+        if uvLayer is not None:
+            #per loop (u, 1 - v), as the importer flips v
+            uvs = np.empty(len(mesh.loops) * 2, np.float32)
+            uvLayer.data.foreach_get('uv', uvs)
+            uvs = uvs.reshape(-1, 2)[triLoops.reshape(-1, 3)]
+            triangles['u'] = uvs[..., 0]
+            triangles['v'] = 1.0 - uvs[..., 1]
+        #flat faces are smoothing group 0, smooth ones share group 1
+        triangles['smoothGroup'] = polySmooth[triPolygons]
+        
+        #a group per used material slot, and an ms3d material per slot that has a material
+        slots, groupIndex = np.unique(triMaterials, return_inverse=True)
+        if len(slots) > 255:
+            raise MS3DError('ms3d supports at most 255 groups, the mesh uses ' + str(len(slots)) + ' material slots')
+        triangles['groupIndex'] = groupIndex
+        model.triangles = triangles
+        for slot in slots.tolist():
+            material = mesh.materials[slot] if slot < len(mesh.materials) else None
+            if material is None:
+                model.groups.append(MS3DGroup(name='ms3dGroup' + str(slot)))
+                continue
+            model.groups.append(MS3DGroup(name=material.name, materialIndex=len(model.materials)))
+            model.materials.append(exportMaterial(material, directory))
+    
+    @staticmethod
+    def exportWeights(model, meshObj):
+        """Sets each vertex's bone and up to three more weighted bones as vertex extras, from the vertex groups"""
+        jointIndexes = {joint.name: i for i, joint in enumerate(model.joints)}
+        groupJoints = np.array([jointIndexes.get(group.name, -1) for group in meshObj.vertex_groups] + [-1], np.int32)
+        #vertex group weights have no bulk getter, so they're gathered from each vertex's groups
+        mesh = meshObj.data
+        counts = np.array([len(vertex.groups) for vertex in mesh.vertices], np.int64)
+        influences = np.array([(element.group, element.weight) for vertex in mesh.vertices for element in vertex.groups],
+            np.float64).reshape(-1, 2)
+        vertexIndexes = np.repeat(np.arange(len(mesh.vertices)), counts)
+        boneIds = groupJoints[influences[:, 0].astype(np.int32)]
+        weights = influences[:, 1]
+        used = (boneIds >= 0) & (weights > 0.0)
+        vertexIndexes, boneIds, weights = vertexIndexes[used], boneIds[used], weights[used]
+        
+        #the four heaviest influences of each vertex, in decreasing weight
+        order = np.lexsort((-weights, vertexIndexes))
+        vertexIndexes, boneIds, weights = vertexIndexes[order], boneIds[order], weights[order]
+        ranks = np.arange(len(order)) - np.searchsorted(vertexIndexes, vertexIndexes, 'left')
+        kept = ranks < 4
+        topBones = np.full((len(mesh.vertices), 4), -1, np.int32)
+        topWeights = np.zeros((len(mesh.vertices), 4), np.float64)
+        topBones[vertexIndexes[kept], ranks[kept]] = boneIds[kept]
+        topWeights[vertexIndexes[kept], ranks[kept]] = weights[kept]
+        topWeights /= np.maximum(topWeights.sum(axis=1, keepdims=True), 1e-12)
+        
+        model.vertices['boneId'] = topBones[:, 0]
+        #weights out of 100, the fourth bone implicitly gets the remainder
+        percent = np.rint(topWeights[:, :3] * 100.0)
+        percent[:, 2] = np.clip(100.0 - percent[:, 0] - percent[:, 1], 0.0, percent[:, 2])
+        model.vertexExtras = np.zeros(len(mesh.vertices), vertexExDtypes[2])
+        model.vertexExtras['boneIds'] = topBones[:, 1:]
+        model.vertexExtras['weights'] = percent
+        model.vertexExSubVersion = 2
+    
+    @staticmethod
+    def exportClips(armatureObj, action):
+        """(name, startFrame, endFrame) clips of action, from its NLA strips or else its pose marker pairs"""
+        clips = []
+        animData = armatureObj.animation_data
+        if animData is not None:
+            for track in animData.nla_tracks:
+                for strip in track.strips:
+                    if strip.action == action:
+                        clips.append((strip.name, int(round(strip.action_frame_start)), int(round(strip.action_frame_end))))
+        if not clips and action is not None:
+            markers = {marker.name: marker.frame for marker in action.pose_markers}
+            for name, frame in markers.items():
+                if name + '_end' in markers:
+                    clips.append((name, frame, markers[name + '_end']))
+        return sorted(clips, key=lambda clip: clip[1])
+    
+    #=== Blender Exporter Data
+    bl_idname = "export_test.ms3d"
+    bl_label = "Export MS3D"
+    
+    # ExportHelper mixin class uses this
+    filename_ext = ".ms3d"
+    
+    filter_glob: StringProperty(
+        default="*.ms3d",
+        options={'HIDDEN'},
+        maxlen=255,
+    )
+    
+    doYZFlip: BoolProperty(
+        name="Use Z as Up",
+        description="Flips the Y and Z axis back, for models imported with Z as Up",
+        default=True,
+    )
+    
+    @classmethod
+    def poll(cls, context):
+        return context.active_object is not None and context.active_object.type in ('ARMATURE', 'MESH')
+    
     def execute(self, context):
-        return self.read_ms3d(context, self.filepath, self.doYZFlip, self.doSplitAnim)
+        try:
+            model = export_ms3d(self.filepath, context.active_object, self.doYZFlip, context.scene)
+        except (MS3DError, OSError) as e:
+            self.report({'ERROR'}, str(e))
+            return {'CANCELLED'}
+        self.report({'INFO'}, 'Exported ' + str(len(model.vertices)) + ' vertices, ' + str(len(model.triangles))
+            + ' triangles and ' + str(len(model.joints)) + ' joints')
+        return {'FINISHED'}
+
+def export_ms3d(filepath, obj, doFlipYZ=True, scene=None):
+    """Writes an armature object with its first child mesh, or a mesh object with its armature, as an ms3d file
+    
+    The armature's current action, or its first NLA strip's, provides the keyframes and its
+    NLA strips or pose markers the 'anim' clip lines of the model comment.
+    Returns the written MS3DModel and raises MS3DError when the data doesn't fit in an ms3d file.
+    """
+    scene = scene or bpy.context.scene
+    if obj.type == 'ARMATURE':
+        armatureObj = obj
+        meshObj = next((child for child in obj.children if child.type == 'MESH'), None)
+    else:
+        meshObj = obj
+        armatureObj = obj.parent if obj.parent is not None and obj.parent.type == 'ARMATURE' else None
+        if armatureObj is None:
+            armatureObj = next((modifier.object for modifier in obj.modifiers
+                if modifier.type == 'ARMATURE' and modifier.object is not None), None)
+    
+    model = MS3DModel()
+    model.animFps = scene.render.fps / scene.render.fps_base
+    model.currentTime = scene.frame_current / model.animFps
+    model.totalFrames = scene.frame_end
+    if meshObj is not None:
+        MS3D_Export.exportMesh(model, meshObj.data, os.path.dirname(os.path.abspath(filepath)), doFlipYZ)
+    if armatureObj is not None:
+        action = None
+        animData = armatureObj.animation_data
+        if animData is not None:
+            action = animData.action or next((strip.action for track in animData.nla_tracks for strip in track.strips
+                if strip.action is not None), None)
+        MS3D_Export.exportJoints(model, armatureObj, action, model.animFps, doFlipYZ)
+        if len(model.rotKeys) or len(model.transKeys):
+            lastFrame = max(np.max(model.rotKeys['time'], initial=0.0), np.max(model.transKeys['time'], initial=0.0))
+            model.totalFrames = max(model.totalFrames, int(np.ceil(lastFrame * model.animFps)))
+        model.modelComment = formatClips(MS3D_Export.exportClips(armatureObj, action))
+        if meshObj is not None:
+            MS3D_Export.exportWeights(model, meshObj)
+    write_ms3d(filepath, model)
+    return model
 
 #==
 
@@ -482,15 +1547,26 @@ class MS3D_Import(Operator, ImportHelper):
 def menu_func_import(self, context):
     self.layout.operator(MS3D_Import.bl_idname, text="Milkshape3D (.ms3d)")
 
+def menu_func_export(self, context):
+    self.layout.operator(MS3D_Export.bl_idname, text="Milkshape3D (.ms3d)")
+
 # Register and add to the "file selector" menu (required to use F3 search "Text Import Operator" for quick access)
 def register():
     bpy.utils.register_class(MS3D_Import)
+    bpy.utils.register_class(MS3D_Export)
+    bpy.utils.register_class(MS3D_ClearImageCache)
+    bpy.utils.register_class(MS3D_ClearArrayCache)
     bpy.types.TOPBAR_MT_file_import.append(menu_func_import)
+    bpy.types.TOPBAR_MT_file_export.append(menu_func_export)
 
 
 def unregister():
+    bpy.utils.unregister_class(MS3D_ClearArrayCache)
+    bpy.utils.unregister_class(MS3D_ClearImageCache)
+    bpy.utils.unregister_class(MS3D_Export)
     bpy.utils.unregister_class(MS3D_Import)
     bpy.types.TOPBAR_MT_file_import.remove(menu_func_import)
+    bpy.types.TOPBAR_MT_file_export.remove(menu_func_export)
 
 
 if __name__ == "__main__":